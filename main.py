@@ -26,7 +26,9 @@ from apscheduler.schedulers.background import BackgroundScheduler
 from telegram.ext import Updater
 
 from plugins import glovar
-from plugins.functions.timers import backup_files, interval_min_10, reset_data, send_count, update_admins, update_status
+from plugins.functions.pool import start_pool, stop_pool
+from plugins.functions.timers import backup_files, interval_min_10, reset_data, send_count, update_admins
+from plugins.functions.timers import update_counts, update_status
 from plugins.handlers.command import add_command_handlers
 from plugins.handlers.error import add_error_handlers
 from plugins.handlers.message import add_message_handlers
@@ -34,6 +36,9 @@ from plugins.handlers.message import add_message_handlers
 # Enable logging
 logger = logging.getLogger(__name__)
 
+# Start the process pool before any thread
+start_pool()
+
 # Config session
 updater = Updater(
     token=glovar.bot_token,
@@ -53,6 +58,7 @@ update_status(updater.bot, "online")
 # Timer
 scheduler = BackgroundScheduler(job_defaults={"misfire_grace_time": 60})
 scheduler.add_job(interval_min_10, "interval", minutes=10)
+scheduler.add_job(update_counts, "interval", minutes=10)
 scheduler.add_job(update_status, "cron", [updater.bot, "awake"], minute=randint(30, 34), second=randint(0, 59))
 scheduler.add_job(backup_files, "cron", [updater.bot], hour=20)
 scheduler.add_job(send_count, "cron", [updater.bot], hour=21)
@@ -65,3 +71,5 @@ updater.idle()
 
 # Stop
 updater.stop()
+update_counts(True)
+stop_pool()
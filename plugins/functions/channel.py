@@ -18,12 +18,12 @@
 
 import logging
 from json import dumps
-from typing import List, Optional, Union
+from typing import Dict, List, Optional, Union
 
 from telegram import Bot, Chat, Message
 
 from .. import glovar
-from .etc import code, code_block, general_link, get_forward_name, get_full_name, lang, message_link, thread
+from .etc import code, code_block, general_link, get_message_context, lang, message_link, thread
 from .file import crypt_file, data_to_file, delete_file, get_new_path, save
 from .telegram import get_group_info, send_document, send_message
 
@@ -160,12 +160,12 @@ def forward_evidence(client: Bot, message: Message, level: str, rule: str, lengt
             text += f"{lang('user_score')}{lang('colon')}{code(f'{score:.1f}')}\n"
 
         if lang("name") in rule:
-            name = get_full_name(message.from_user)
+            name = get_message_context(message).get_full_name()
 
             if name:
                 text += f"{lang('user_name')}{lang('colon')}{code(name)}\n"
 
-            forward_name = get_forward_name(message)
+            forward_name = get_message_context(message).get_forward_name()
 
             if forward_name and forward_name != name:
                 text += f"{lang('from_name')}{lang('colon')}{code(forward_name)}\n"
@@ -253,6 +253,32 @@ def send_debug(client: Bot, chat: Chat, action: str, uid: int, mid: int, em: Mes
     return False
 
 
+def send_quarantine(client: Bot) -> bool:
+    # Send the newly quarantined regex rules to the debug channel
+    try:
+        if not glovar.regex_reports:
+            return True
+
+        with glovar.locks["regex"]:
+            reports = glovar.regex_reports
+            glovar.regex_reports = []
+
+        for word_type, word, cost in reports:
+            text = (f"{lang('project')}{lang('colon')}{general_link(glovar.project_name, glovar.project_link)}\n"
+                    f"{lang('action')}{lang('colon')}{code(lang('regex_quarantine'))}\n"
+                    f"{lang('regex_type')}{lang('colon')}{code(word_type)}\n"
+                    f"{lang('rule')}{lang('colon')}{code(word)}\n"
+                    f"{lang('regex_cost')}{lang('colon')}{code(f'{cost:.3f}s')}\n"
+                    f"{lang('reason')}{lang('colon')}{code(lang('regex_slow'))}\n")
+            thread(send_message, (client, glovar.debug_channel_id, text))
+
+        return True
+    except Exception as e:
+        logger.warning(f"Send quarantine error: {e}", exc_info=True)
+
+    return False
+
+
 def share_bad_user(client: Bot, uid: int) -> bool:
     # Share a bad user with other bots
     try:
@@ -377,6 +403,42 @@ def share_regex_count(client: Bot, word_type: str) -> bool:
     return False
 
 
+def share_regex_profile(client: Bot, word_type: str, profile: Dict[str, List[float]]) -> bool:
+    # Use this function to share the costs of the regex rules to REGEX
+    try:
+        if not glovar.regex.get(word_type):
+            return True
+
+        words = eval(f"glovar.{word_type}_words")
+        data = {
+            word: {
+                "calls": int(profile[word][0]),
+                "total": round(profile[word][1], 6),
+                "worst": round(profile[word][2], 6)
+            }
+            for word in profile if word in words
+        }
+
+        if not data:
+            return True
+
+        file = data_to_file(data)
+        share_data(
+            client=client,
+            receivers=["REGEX"],
+            action="regex",
+            action_type="profile",
+            data=f"{word_type}_words",
+            file=file
+        )
+
+        return True
+    except Exception as e:
+        logger.warning(f"Share regex profile error: {e}", exc_info=True)
+
+    return False
+
+
 def share_watch_user(client: Bot, the_type: str, uid: int, until: str) -> bool:
     # Share a watch ban user with other bots
     try:
@@ -17,18 +17,20 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
+import re
 from datetime import datetime
+from functools import lru_cache
 from html import escape
 from json import dumps
 from random import choice
 from string import ascii_letters, digits
-from threading import Thread, Timer
+from threading import Lock, Thread, Timer
 from time import localtime, strftime, time
-from typing import Any, Callable, Optional, Union
+from typing import Any, Callable, Dict, Optional, Tuple, Union
 from unicodedata import normalize
 
 from cryptography.fernet import Fernet
-from opencc import convert
+from opencc import OpenCC
 from telegram import Message, User
 
 from .. import glovar
@@ -36,6 +38,95 @@ from .. import glovar
 # Enable logging
 logger = logging.getLogger(__name__)
 
+# Code points that the traditional to simplified conversion may change
+cjk_pattern = re.compile(r"[\u2e80-\u9fff\uf900-\ufaff\ufe30-\ufe4f\U00020000-\U0003ffff]")
+
+# Check if the text is ASCII, str.isascii is available since Python 3.7
+is_ascii: Callable[[str], bool] = getattr(str, "isascii", None) or (lambda text: not re.search(r"[^\x00-\x7f]", text))
+
+# Characters encoded at a time when counting the UTF-8 length
+length_chunk: int = 4096
+
+# Converter of the traditional Chinese, created when first used
+converter: Optional[OpenCC] = None
+converter_lock = Lock()
+
+# Texts up to this length are cached after the conversion, such as names
+short_length: int = 64
+
+
+class MessageContext:
+    # Derived data of a message, each value is computed once for the update
+    def __init__(self, message: Message):
+        # The message
+        self.message: Message = message
+
+        # Computed values, as {(name, normal, printable): value}
+        self.values: Dict[Tuple[str, bool, bool], Any] = {}
+
+    def get_forward_name(self, normal: bool = False, printable: bool = False) -> str:
+        # Get the forward name of the message
+        key = ("forward_name", normal, printable)
+
+        if key not in self.values:
+            self.values[key] = get_forward_name(self.message, normal, printable)
+
+        return self.values[key]
+
+    def get_full_name(self, normal: bool = False, printable: bool = False) -> str:
+        # Get the full name of the sender
+        key = ("full_name", normal, printable)
+
+        if key not in self.values:
+            self.values[key] = get_full_name(self.message.from_user, normal, printable)
+
+        return self.values[key]
+
+    def get_length(self) -> int:
+        # Get the UTF-8 length of the raw text
+        key = ("length", False, False)
+
+        if key not in self.values:
+            self.values[key] = get_length(self.get_text())
+
+        return self.values[key]
+
+    def get_now(self) -> int:
+        # Get the time of the message
+        key = ("now", False, False)
+
+        if key not in self.values:
+            self.values[key] = get_int(self.message.date.strftime("%s")) or get_now()
+
+        return self.values[key]
+
+    def get_text(self, normal: bool = False, printable: bool = False) -> str:
+        # Get the text of the message
+        key = ("text", normal, printable)
+
+        if key not in self.values:
+            self.values[key] = get_text(self.message, normal, printable)
+
+        return self.values[key]
+
+
+class PrintableTable(dict):
+    # Translation table deleting the non-printable characters, filled with the characters seen
+    def __missing__(self, key: int) -> Optional[int]:
+        char = chr(key)
+
+        if char.isprintable() or char in {"\n", "\r", "\t"}:
+            result = key
+        else:
+            result = None
+
+        self[key] = result
+
+        return result
+
+
+printable_table = PrintableTable()
+
 
 def bold(text: Any) -> str:
     # Get a bold text
@@ -199,6 +290,20 @@ def get_command_type(message: Message) -> str:
     return result
 
 
+def get_converter() -> OpenCC:
+    # Get the converter of the traditional Chinese
+    global converter
+
+    if converter:
+        return converter
+
+    with converter_lock:
+        if not converter:
+            converter = OpenCC("t2s.json")
+
+    return converter
+
+
 def get_forward_name(message: Message, normal: bool = False, printable: bool = False) -> str:
     # Get forwarded message's origin sender's name
     text = ""
@@ -251,6 +356,32 @@ def get_int(text: str) -> Optional[int]:
     return result
 
 
+def get_length(text: str, limit: int = 0) -> int:
+    # Get the UTF-8 length of the text without encoding it at once, stop counting once the limit is reached
+    if is_ascii(text):
+        return len(text)
+
+    result = 0
+
+    for i in range(0, len(text), length_chunk):
+        result += len(text[i:i + length_chunk].encode())
+
+        if limit and result >= limit:
+            break
+
+    return result
+
+
+def get_message_context(message: Message) -> MessageContext:
+    # Get the context of the message, shared in the update being checked
+    context = getattr(glovar.memo, "context", None)
+
+    if context and context.message is message:
+        return context
+
+    return MessageContext(message)
+
+
 def get_now() -> int:
     # Get time for now
     result = 0
@@ -297,6 +428,17 @@ def get_text(message: Message, normal: bool = False, printable: bool = False) ->
     return text
 
 
+def is_length_reached(text: str, limit: int) -> bool:
+    # Check if the UTF-8 length of the text reaches the limit, a character has 1 to 4 bytes
+    if len(text) >= limit:
+        return True
+
+    if len(text) * 4 < limit:
+        return False
+
+    return get_length(text, limit) >= limit
+
+
 def lang(text: str) -> str:
     # Get the text
     result = ""
@@ -342,6 +484,23 @@ def random_str(i: int) -> str:
     return text
 
 
+def t2s(text: str) -> str:
+    # Convert the traditional Chinese to the simplified Chinese
+    if not cjk_pattern.search(text):
+        return text
+
+    if len(text) <= short_length:
+        return t2s_short(text)
+
+    return get_converter().convert(text)
+
+
+@lru_cache(maxsize=4096)
+def t2s_short(text: str) -> str:
+    # Convert a short text, the result is cached
+    return get_converter().convert(text)
+
+
 def t2t(text: str, normal: bool, printable: bool) -> str:
     # Convert the string, text to text
     try:
@@ -349,16 +508,18 @@ def t2t(text: str, normal: bool, printable: bool) -> str:
             return ""
 
         if normal:
-            for special in ["spc", "spe"]:
-                text = "".join(eval(f"glovar.{special}_dict").get(t, t) for t in text)
+            pattern = glovar.special_pattern
+
+            if pattern and pattern.search(text):
+                text = text.translate(glovar.special_table)
 
             text = normalize("NFKC", text)
 
-        if printable:
-            text = "".join(t for t in text if t.isprintable() or t in {"\n", "\r", "\t"})
+        if printable and not text.isprintable():
+            text = text.translate(printable_table)
 
         if normal and glovar.zh_cn:
-            text = convert(text, config="t2s.json")
+            text = t2s(text)
     except Exception as e:
         logger.warning(f"T2T error: {e}", exc_info=True)
 
@@ -17,18 +17,18 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
-import re
-from copy import deepcopy
 from string import ascii_lowercase
-from typing import Match, Optional, Union
+from typing import Callable, Dict, Iterable, List, Match, Optional, Tuple, Union
 
 from telegram import Message, User
 from telegram.ext import BaseFilter
 
 from .. import glovar
-from .etc import get_now, get_int, get_forward_name, get_full_name, get_text
-from .file import save
+from .etc import get_message_context, get_now, is_length_reached, thread
 from .ids import init_group_id
+from .pool import get_pool_hits
+from .regex import Budget, PreparedText, RuleBundle, RuleSet, ban_types, get_ban_verdict, get_nm_verdict
+from .regex import get_prepared, get_wb_verdict, nm_types, sort_words, wb_types
 
 # Enable logging
 logger = logging.getLogger(__name__)
@@ -249,54 +249,259 @@ new_group = FilterNewGroup()
 test_group = FilterTestGroup()
 
 
-def is_ad_text(text: str, ocr: bool, matched: str = "") -> str:
-    # Check if the text is ad text
+def add_hit_counts(hits: Dict[str, Tuple[str, Match]], word_types: List[str]) -> bool:
+    # Count the hits of the credited word types
     try:
-        if not text:
-            return ""
+        for word_type in word_types:
+            add_regex_count(word_type, hits[word_type][0])
 
-        for c in ascii_lowercase:
-            if c != matched and is_regex_text(f"ad{c}", text, ocr):
-                return c
+        return True
     except Exception as e:
-        logger.warning(f"Is ad text error: {e}", exc_info=True)
+        logger.warning(f"Add hit counts error: {e}", exc_info=True)
 
-    return ""
+    return False
 
 
-def is_ban_text(text: str, ocr: bool, message: Message = None) -> bool:
-    # Check if the text is ban text
+def add_regex_count(word_type: str, word: str) -> bool:
+    # Count a hit of the regex rule in the buffer
     try:
-        if is_regex_text("ban", text, ocr):
-            return True
+        with glovar.locks["count"]:
+            counts = glovar.regex_counts.setdefault(word_type, {})
+            counts[word] = counts.get(word, 0) + 1
 
-        # ad + con
-        ad = is_regex_text("ad", text, ocr)
-        con = is_con_text(text, ocr)
+        # Record the credit for the cached verdicts
+        credits = getattr(glovar.memo, "credits", None)
+        if credits is not None:
+            credits.append((word_type, word))
 
-        if ad and con:
-            return True
+        return True
+    except Exception as e:
+        logger.warning(f"Add regex count error: {e}", exc_info=True)
+
+    return False
 
-        # emoji + con
-        emoji = is_emoji("ad", text, message)
 
-        if emoji and con:
+def add_regex_profile(budget: Budget) -> bool:
+    # Add the costs of the searched rules to the profile
+    try:
+        if not budget.costs:
             return True
 
-        # ad_ + con
-        ad = is_ad_text(text, ocr)
+        costs = budget.costs
+        budget.costs = {}
 
-        if ad and con:
-            return True
+        with glovar.locks["count"]:
+            for (word_type, word), (calls, total, worst) in costs.items():
+                profile = glovar.regex_profile.setdefault(word_type, {})
+                one = profile.get(word)
+
+                if one is None:
+                    profile[word] = [calls, total, worst]
+                    continue
+
+                one[0] += calls
+                one[1] += total
+                one[2] = max(one[2], worst)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Add regex profile error: {e}", exc_info=True)
+
+    return False
+
+
+def get_emoji_counts(text: str) -> Dict[str, int]:
+    # Count the emoji in the text in one pass, the longest emoji is taken at each position
+    result = {}
+    try:
+        if not glovar.emoji_start:
+            return {}
+
+        search = glovar.emoji_start.search
+        match = search(text)
+
+        while match:
+            start = match.start()
+            end = 0
+            node = glovar.emoji_trie
+
+            for i in range(start, len(text)):
+                node = node.get(text[i])
+
+                if node is None:
+                    break
+
+                if "" in node:
+                    end = i + 1
+
+            if not end:
+                match = search(text, start + 1)
+                continue
+
+            emoji = text[start:end]
+            result[emoji] = result.get(emoji, 0) + 1
+            match = search(text, end)
+    except Exception as e:
+        logger.warning(f"Get emoji counts error: {e}", exc_info=True)
+
+    return result
+
+
+def get_hit_type(hits: Dict[str, Tuple[str, Match]], word_types: List[str]) -> str:
+    # Get the first hit word type in order, count the hit
+    try:
+        for word_type in word_types:
+            if word_type not in hits:
+                continue
+
+            add_regex_count(word_type, hits[word_type][0])
+
+            return word_type
+    except Exception as e:
+        logger.warning(f"Get hit type error: {e}", exc_info=True)
+
+    return ""
 
-        # ad_ + emoji
-        if ad and emoji:
-            return True
 
-        # ad_ + ad_
-        if ad:
-            ad = is_ad_text(text, ocr, ad)
-            return bool(ad)
+def get_prepared_text(text: Union[str, PreparedText]) -> PreparedText:
+    # Get the prepared text, share it within the update being processed
+    result = None
+    try:
+        texts = getattr(glovar.memo, "texts", None)
+
+        if texts is None or not isinstance(text, str):
+            return get_prepared(text)
+
+        result = texts.get(text)
+
+        if result is None:
+            result = get_prepared(text)
+            texts[text] = result
+    except Exception as e:
+        logger.warning(f"Get prepared text error: {e}", exc_info=True)
+
+    return result or get_prepared(text)
+
+
+def get_regex_budget() -> Optional[Budget]:
+    # Get the time budget of the update being processed, or a new one for a single check
+    if not glovar.regex_timing:
+        return None
+
+    result = getattr(glovar.memo, "budget", None)
+
+    if result is None:
+        result = Budget(glovar.regex_budget, glovar.regex_slow)
+
+    return result
+
+
+def get_regex_bundle(word_types: List[str]) -> RuleBundle:
+    # Get the rule bundle of the word types, rebuild it if the rules have changed
+    result = None
+    try:
+        rule_sets = glovar.compiled.get_snapshot(word_types)
+        key = tuple(word_types)
+        result = glovar.bundles.get(key)
+
+        if result and all(result.rule_sets[word_type] is rule_sets[word_type] for word_type in word_types):
+            return result
+
+        result = RuleBundle(rule_sets, glovar.regex_combine, glovar.regex_prefilter, glovar.regex_engine,
+                            glovar.regex_casefold)
+        glovar.bundles[key] = result
+    except Exception as e:
+        logger.warning(f"Get regex bundle error: {e}", exc_info=True)
+
+    return result
+
+
+def get_regex_hits(word_types: List[str], text: Union[str, PreparedText],
+                   ocr: bool = False) -> Dict[str, Tuple[str, Match]]:
+    # Check the text with several word types at once, return the hit rule and the match of each hit type
+    result = {}
+    try:
+        prepared = get_prepared_text(text)
+
+        if not prepared.text:
+            return {}
+
+        # Each word type is checked once for a prepared text
+        checks = [word_type for word_type in word_types if (word_type, ocr) not in prepared.hits]
+
+        if checks:
+            budget = get_regex_budget()
+            text = prepared.get_collapsed()
+
+            bundle = get_regex_bundle(checks)
+
+            # Long texts are checked in the process pool if possible
+            hits = get_pool_hits(checks, prepared, ocr, bundle, budget)
+
+            if hits is None:
+                hits = bundle.search(text, ocr, folded=prepared.get_folded(text), budget=budget)
+                rest = [word_type for word_type in checks if word_type not in hits]
+
+                # Try again
+                if rest and " " in text:
+                    text = prepared.get_stripped()
+                    hits.update(bundle.search(text, ocr, rest, prepared.get_folded(text), budget))
+
+            for word_type in checks:
+                prepared.hits[(word_type, ocr)] = hits.get(word_type)
+
+            if budget and budget.exceeded:
+                logger.warning(f"Regex budget exceeded, skipped the rest rules of {checks} on {len(text)} chars")
+
+            if budget:
+                add_regex_profile(budget)
+                update_slow_rules(budget)
+
+        result = {word_type: prepared.hits[(word_type, ocr)] for word_type in word_types
+                  if prepared.hits[(word_type, ocr)]}
+    except Exception as e:
+        logger.warning(f"Get regex hits error: {e}", exc_info=True)
+
+    return result
+
+
+def get_rule_words(word_type: str) -> List[str]:
+    # Get the rules of the word type in the order of checking, the regex lock should be held
+    quarantine = glovar.regex_quarantine.get(word_type, set())
+    words = [word for word in eval(f"glovar.{word_type}_words") if word not in quarantine]
+
+    return sort_words(words, glovar.regex_ranks.get(word_type, {}))
+
+
+def is_ad_text(text: Union[str, PreparedText], ocr: bool, matched: str = "") -> str:
+    # Check if the text is ad text
+    try:
+        if not get_prepared_text(text).text:
+            return ""
+
+        word_types = [f"ad{c}" for c in ascii_lowercase if c != matched]
+        hits = get_regex_hits(word_types, text, ocr)
+
+        return get_hit_type(hits, word_types)[2:]
+    except Exception as e:
+        logger.warning(f"Is ad text error: {e}", exc_info=True)
+
+    return ""
+
+
+def is_ban_text(text: Union[str, PreparedText], ocr: bool, message: Message = None,
+                hits: Dict[str, Tuple[str, Match]] = None) -> bool:
+    # Check if the text is ban text
+    try:
+        text = get_prepared_text(text)
+
+        if hits is None:
+            hits = get_regex_hits(ban_types, text, ocr)
+
+        result, credited = get_ban_verdict(hits, lambda: is_emoji("ad", text.text, message))
+        add_hit_counts(hits, credited)
+
+        return result
     except Exception as e:
         logger.warning(f"Is ban text error: {e}", exc_info=True)
 
@@ -384,12 +589,13 @@ def is_class_e_user(user: Union[int, User]) -> bool:
     return False
 
 
-def is_con_text(text: str, ocr: bool) -> bool:
+def is_con_text(text: Union[str, PreparedText], ocr: bool) -> bool:
     # Check if the text is con text
     try:
-        if (is_regex_text("con", text, ocr)
-                or is_regex_text("iml", text, ocr)
-                or is_regex_text("pho", text, ocr)):
+        word_types = ["con", "iml", "pho"]
+        hits = get_regex_hits(word_types, text, ocr)
+
+        if get_hit_type(hits, word_types):
             return True
     except Exception as e:
         logger.warning(f"Is con text error: {e}", exc_info=True)
@@ -432,7 +638,7 @@ def is_detected_user(message: Message) -> bool:
 
         gid = message.chat.id
         uid = message.from_user.id
-        now = get_int(message.date.strftime("%s")) or get_now()
+        now = get_message_context(message).get_now()
 
         return is_detected_user_id(gid, uid, now)
     except Exception as e:
@@ -463,18 +669,9 @@ def is_emoji(the_type: str, text: str, message: Message = None) -> bool:
     # Check the emoji type
     try:
         if message:
-            text = get_text(message, False, False)
-
-        emoji_dict = {}
-        emoji_set = {emoji for emoji in glovar.emoji_set if emoji in text and emoji not in glovar.emoji_protect}
-        emoji_old_set = deepcopy(emoji_set)
-
-        for emoji in emoji_old_set:
-            if any(emoji in emoji_old and emoji != emoji_old for emoji_old in emoji_old_set):
-                emoji_set.discard(emoji)
+            text = get_message_context(message).get_text()
 
-        for emoji in emoji_set:
-            emoji_dict[emoji] = text.count(emoji)
+        emoji_dict = get_emoji_counts(text)
 
         # Check ad
         if the_type == "ad":
@@ -569,9 +766,11 @@ def is_long_text(message: Message) -> int:
 
         # Basic data
         gid = message.chat.id
+        uid = message.from_user and message.from_user.id
+        context = get_message_context(message)
 
         # Get text
-        text = get_text(message)
+        text = context.get_text()
 
         if not text.strip():
             return 0
@@ -580,29 +779,29 @@ def is_long_text(message: Message) -> int:
         if is_detected_user(message):
             return 79
 
-        # Get length
-        length = len(text.encode())
-
         # Check limit
-        if length < glovar.configs[gid]["limit"]:
+        if not is_length_reached(text, glovar.configs[gid]["limit"]):
             return 0
 
+        # Get length
+        length = context.get_length()
+
         # Work with NOSPAM
         if length <= 10000:
             # Check the forward from name:
-            forward_name = get_forward_name(message, True, True)
+            forward_name = context.get_forward_name()
 
-            if is_nm_text(forward_name):
+            if is_name_text("nm", uid, forward_name, lambda: context.get_forward_name(True, True)):
                 return 0
 
             # Check the user's name:
-            name = get_full_name(message.from_user, True, True)
+            name = context.get_full_name()
 
-            if is_nm_text(name):
+            if is_name_text("nm", uid, name, lambda: context.get_full_name(True, True)):
                 return 0
 
-            # Check the text
-            normal_text = get_text(message, True, True)
+            # Check the text, the variants are shared by all the checks
+            normal_text = get_prepared_text(context.get_text(True, True))
 
             if glovar.nospam_id in glovar.admin_ids[gid]:
                 if is_ban_text(normal_text, False):
@@ -618,6 +817,70 @@ def is_long_text(message: Message) -> int:
     return 0
 
 
+def is_name_text(the_type: str, uid: int, name: str, get_normal: Callable[[], str]) -> bool:
+    # Check if the user's name is nm or wb text, the verdicts are cached until the rules of the checks change
+    try:
+        if not name:
+            return False
+
+        key = (uid, name)
+        word_types = nm_types + ban_types if the_type == "nm" else wb_types
+        version = tuple(rule_set.content for rule_set in glovar.compiled.get_snapshot(word_types).values())
+
+        with glovar.locks["name"]:
+            cache = glovar.names.get(key)
+
+            if cache:
+                glovar.names.move_to_end(key)
+
+        verdict = cache and cache["verdicts"].get(the_type)
+
+        # Credit the rules again as the checks would do
+        if verdict and verdict[0] == version:
+            _, result, credits = verdict
+
+            for word_type, word in credits:
+                add_regex_count(word_type, word)
+
+            return result
+
+        normal = cache["normal"] if cache else get_normal()
+        budget = get_regex_budget()
+        glovar.memo.credits = []
+
+        try:
+            if the_type == "nm":
+                result = is_nm_text(normal)
+            else:
+                result = is_wb_text(normal, False)
+
+            credits = glovar.memo.credits
+        finally:
+            glovar.memo.credits = None
+
+        # The verdict is not complete
+        if budget and budget.exceeded:
+            return result
+
+        with glovar.locks["name"]:
+            cache = glovar.names.get(key)
+
+            if not cache:
+                cache = {"normal": normal, "verdicts": {}}
+                glovar.names[key] = cache
+
+            cache["verdicts"][the_type] = (version, result, credits)
+
+            while len(glovar.names) > glovar.names_limit:
+                glovar.names.popitem(last=False)
+
+        return result
+    except Exception as e:
+        logger.warning(f"Is name text error: {e}", exc_info=True)
+
+    return False
+
+
 def is_new_user(user: User, now: int, gid: int = 0, joined: bool = False) -> bool:
     # Check if the message is sent from a new joined member
     try:
@@ -652,52 +915,31 @@ def is_new_user(user: User, now: int, gid: int = 0, joined: bool = False) -> boo
     return False
 
 
-def is_nm_text(text: str) -> bool:
+def is_nm_text(text: Union[str, PreparedText]) -> bool:
     # Check if the text is nm text
     try:
-        if (is_regex_text("nm", text)
-                or is_regex_text("bio", text)
-                or is_ban_text(text, False)):
-            return True
+        text = get_prepared_text(text)
+        hits = get_regex_hits(nm_types + ban_types, text)
+        result, credited = get_nm_verdict(hits, lambda: is_emoji("ad", text.text))
+        add_hit_counts(hits, credited)
+
+        return result
     except Exception as e:
         logger.warning(f"Is nm text error: {e}", exc_info=True)
 
     return False
 
 
-def is_regex_text(word_type: str, text: str, ocr: bool = False, again: bool = False) -> Optional[Match]:
+def is_regex_text(word_type: str, text: Union[str, PreparedText], ocr: bool = False) -> Optional[Match]:
     # Check if the text hit the regex rules
     result = None
     try:
-        if text:
-            if not again:
-                text = re.sub(r"\s{2,}", " ", text)
-            elif " " in text:
-                text = re.sub(r"\s", "", text)
-            else:
-                return None
-        else:
-            return None
+        hits = get_regex_hits([word_type], text, ocr)
 
-        with glovar.locks["regex"]:
-            words = list(eval(f"glovar.{word_type}_words"))
-
-        for word in words:
-            if ocr and "(?# nocr)" in word:
-                continue
-
-            result = re.search(word, text, re.I | re.S | re.M)
-
-            # Count and return
-            if result:
-                count = eval(f"glovar.{word_type}_words").get(word, 0)
-                count += 1
-                eval(f"glovar.{word_type}_words")[word] = count
-                save(f"{word_type}_words")
-                return result
+        if not get_hit_type(hits, [word_type]):
+            return None
 
-        # Try again
-        return is_regex_text(word_type, text, ocr, True)
+        result = hits[word_type][1]
     except Exception as e:
         logger.warning(f"Is regex text error: {e}", exc_info=True)
 
@@ -721,21 +963,97 @@ def is_watch_user(user: User, the_type: str, now: int) -> bool:
     return False
 
 
-def is_wb_text(text: str, ocr: bool) -> bool:
+def is_wb_text(text: Union[str, PreparedText], ocr: bool) -> bool:
     # Check if the text is wb text
     try:
-        if (is_regex_text("wb", text, ocr)
-                or is_regex_text("ad", text, ocr)
-                or is_regex_text("iml", text, ocr)
-                or is_regex_text("pho", text, ocr)
-                or is_regex_text("sho", text, ocr)
-                or is_regex_text("spc", text, ocr)):
-            return True
+        hits = get_regex_hits(wb_types, text, ocr)
+        result, credited = get_wb_verdict(hits)
+        add_hit_counts(hits, credited)
 
-        for c in ascii_lowercase:
-            if c not in {"i"} and is_regex_text(f"ad{c}", text, ocr):
-                return True
+        return result
     except Exception as e:
         logger.warning(f"Is wb text error: {e}", exc_info=True)
 
     return False
+
+
+def update_rule_sets(word_types: Iterable[str]) -> bool:
+    # Apply the changed rules of the word types, only the new rules are compiled, the regex lock should not be held
+    try:
+        for word_type in set(word_types):
+            while True:
+                with glovar.locks["regex"]:
+                    old = glovar.compiled.get(word_type)
+                    words = get_rule_words(word_type)
+
+                if old and old.words == words:
+                    break
+
+                rule_set = RuleSet(
+                    words=words,
+                    combine=glovar.regex_combine,
+                    prefilter=glovar.regex_prefilter,
+                    word_type=word_type,
+                    engine=glovar.regex_engine,
+                    casefold=glovar.regex_casefold,
+                    previous=old
+                )
+
+                # The rules may be updated while compiling, publish the new version only if nothing has changed
+                if glovar.compiled.publish(word_type, rule_set, old):
+                    break
+
+            # Rebuild the affected bundles before the checks need them
+            for key in [key for key in list(glovar.bundles) if word_type in key]:
+                get_regex_bundle(list(key))
+
+        return True
+    except Exception as e:
+        logger.warning(f"Update rule sets error: {e}", exc_info=True)
+
+    return False
+
+
+def update_slow_rules(budget: Budget) -> bool:
+    # Record the slow rules, quarantine the rules that are too slow repeatedly within the window
+    try:
+        if not budget.records:
+            return True
+
+        records = budget.records
+        budget.records = {}
+
+        now = get_now()
+        word_types = set()
+
+        with glovar.locks["regex"]:
+            for (word_type, word), cost in records.items():
+                slow_times = glovar.regex_slow_times.setdefault(word_type, {})
+                times = [t for t in slow_times.get(word, []) if now - t < glovar.regex_slow_window]
+                times.append(now)
+                slow_times[word] = times
+
+                if len(times) < glovar.regex_slow_limit:
+                    continue
+
+                slow_times.pop(word, None)
+                quarantine = glovar.regex_quarantine.setdefault(word_type, set())
+
+                # Too many rules of the word type are quarantined, keep the rest working
+                if len(quarantine) >= glovar.regex_quarantine_limit:
+                    logger.warning(f"Regex quarantine of {word_type} is full, kept the slow rule: {word}")
+                    continue
+
+                quarantine.add(word)
+                glovar.regex_reports.append((word_type, word, cost))
+                word_types.add(word_type)
+
+        # Compile the rest rules without blocking the check
+        if word_types:
+            thread(update_rule_sets, (list(word_types),))
+
+        return True
+    except Exception as e:
+        logger.warning(f"Update slow rules error: {e}", exc_info=True)
+
+    return False
@@ -0,0 +1,290 @@
+# SCP-079-LONG - Control super long messages
+# Copyright (C) 2019-2020 SCP-079 <https://scp-079.org>
+#
+# This file is part of SCP-079-LONG.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+from itertools import count
+from multiprocessing import get_context, TimeoutError
+from time import perf_counter
+from typing import Any, Dict, List, Match, Optional, Set, Tuple
+
+from .. import glovar
+from .regex import Budget, PreparedText, RuleBundle, RuleSet, compile_rule, done_bits, init_worker, scan_worker
+from .regex import search_worker
+
+# Enable logging
+logger = logging.getLogger(__name__)
+
+# Ids of the window scans
+scans: Any = count(1)
+
+# Slots of the cancelled scans shared with the workers
+slots: int = 64
+
+
+def get_chunk_hits(word_types: List[str], rule_sets: Dict[str, RuleSet], text: str, ocr: bool,
+                   found: Optional[Set[str]], limits: Optional[Tuple[float, float]], timeout: Optional[float],
+                   budget: Optional[Budget]) -> Dict[str, Tuple[str, int]]:
+    # Scan the text by overlapping windows in the workers, return the hit rule and the start of each hit type
+    # Once a word type has a hit, the windows not started yet skip it, and they are cancelled once every word type
+    # has a hit, so the verdicts are exact, but the credited rule is the first one in order among the windows that
+    # searched the word type, not always the first one in the whole text
+    result = {}
+    scan = next(scans)
+    slot = scan % slots
+    try:
+        pool = glovar.pool
+        size = glovar.regex_chunk_length
+        settings = (glovar.regex_combine, glovar.regex_prefilter, glovar.regex_engine, glovar.regex_casefold)
+        glovar.pool_cancel[slot] = 0
+        glovar.pool_done[slot] = 0
+        done = set()
+
+        def update_done(output: Tuple[str, Any]) -> None:
+            # Share the hit word types with the workers as soon as a window is finished
+            status, data = output
+
+            if status != "hits":
+                return
+
+            for word_type in data[0]:
+                done.add(word_type)
+                position = word_types.index(word_type)
+
+                if position < done_bits:
+                    glovar.pool_done[slot] |= 1 << position
+
+            if len(done) == len(word_types):
+                glovar.pool_cancel[slot] = scan
+
+        # The first task searches the rules without a bounded width in the whole text
+        windows = [None] + [(start, min(start + size, len(text))) for start in range(0, len(text), size)]
+        tasks = [pool.apply_async(scan_worker,
+                                  (get_pool_rules(word_types, rule_sets), text, ocr, settings, limits, window,
+                                   (slot, scan), found),
+                                  callback=update_done)
+                 for window in windows]
+        hits = {}
+
+        # Every task is collected, the cancelled ones return at once
+        for window, task in zip(windows, tasks):
+            try:
+                status, data = task.get(timeout)
+
+                # The worker has old rules, send the words
+                if status == "stale":
+                    task = pool.apply_async(scan_worker,
+                                            (get_pool_rules(word_types, rule_sets, True), text, ocr, settings,
+                                             limits, window, (slot, scan), found),
+                                            callback=update_done)
+                    status, data = task.get(timeout)
+            except TimeoutError:
+                logger.warning(f"Pool scan timeout, skipped the window {window}")
+                if budget:
+                    budget.update({}, {}, True)
+
+                continue
+
+            if status == "cancelled":
+                continue
+
+            if status != "hits":
+                logger.warning(f"Pool scan failed, skipped the window {window}")
+                continue
+
+            window_hits, costs, records, exceeded = data
+
+            if budget:
+                budget.update(costs, records, exceeded)
+
+            # The first rule in order is credited
+            for word_type, hit in window_hits.items():
+                if word_type not in hits or hit[0] < hits[word_type][0]:
+                    hits[word_type] = hit
+
+        result = {word_type: (word, start) for word_type, (_, word, start) in hits.items()}
+    except Exception as e:
+        logger.warning(f"Get chunk hits error: {e}", exc_info=True)
+    finally:
+        glovar.pool_cancel[slot] = scan
+
+    return result
+
+
+def get_pool_found(bundle: RuleBundle, prepared: PreparedText, text: str) -> Optional[Set[str]]:
+    # Get the literals of the bundle found in a variant of the text, None without the prefilter
+    result = None
+    try:
+        if not bundle.prefilter:
+            return None
+
+        result = bundle.prefilter.search(prepared.get_folded(text))
+    except Exception as e:
+        logger.warning(f"Get pool found error: {e}", exc_info=True)
+
+    return result
+
+
+def get_pool_hits(word_types: List[str], prepared: PreparedText, ocr: bool, bundle: RuleBundle,
+                  budget: Optional[Budget]) -> Optional[Dict[str, Tuple[str, Match]]]:
+    # Check a long text in the process pool, split the word types between the workers, None if not available
+    result = None
+    try:
+        pool = glovar.pool
+        text = prepared.get_collapsed()
+
+        if not pool or not bundle or len(text) < glovar.regex_process_length:
+            return None
+
+        rule_sets = bundle.rule_sets
+
+        # The workers get the rest of the budget
+        limits = None
+        timeout = None
+
+        if budget:
+            seconds = budget.deadline and budget.deadline - perf_counter()
+
+            if budget.exceeded or seconds < 0:
+                budget.exceeded = True
+                return {}
+
+            limits = (seconds, budget.slow)
+            timeout = seconds + 1 if seconds else None
+
+        # Very long texts are scanned by windows
+        if glovar.regex_chunk_length and len(text) > glovar.regex_chunk_length:
+            result = {}
+
+            # The literals are found once here, not again in every window
+            found = get_pool_found(bundle, prepared, text)
+
+            for word_type, (word, start) in get_chunk_hits(word_types, rule_sets, text, ocr, found,
+                                                           limits, timeout, budget).items():
+                result[word_type] = (word, get_pool_match(word, prepared, "collapsed", start))
+
+            rest = [word_type for word_type in word_types if word_type not in result]
+
+            # Try again
+            if rest and " " in text:
+                text = prepared.get_stripped()
+                found = get_pool_found(bundle, prepared, text)
+
+                for word_type, (word, start) in get_chunk_hits(rest, rule_sets, text, ocr, found,
+                                                               limits, timeout, budget).items():
+                    result[word_type] = (word, get_pool_match(word, prepared, "stripped", start))
+
+            return result
+
+        settings = (glovar.regex_combine, glovar.regex_prefilter, glovar.regex_engine, glovar.regex_casefold)
+        chunks = [word_types[i::glovar.regex_processes] for i in range(glovar.regex_processes)]
+        chunks = [chunk for chunk in chunks if chunk]
+        tasks = [pool.apply_async(search_worker, (get_pool_rules(chunk, rule_sets), text, ocr, settings, limits))
+                 for chunk in chunks]
+        result = {}
+
+        for chunk, task in zip(chunks, tasks):
+            try:
+                status, data = task.get(timeout)
+
+                # The worker has old rules, send the words
+                if status == "stale":
+                    task = pool.apply_async(search_worker,
+                                            (get_pool_rules(chunk, rule_sets, True), text, ocr, settings, limits))
+                    status, data = task.get(timeout)
+            except TimeoutError:
+                logger.warning(f"Pool search timeout, skipped the rules of {chunk}")
+                if budget:
+                    budget.update({}, {}, True)
+
+                continue
+
+            if status != "hits":
+                logger.warning(f"Pool search failed, skipped the rules of {chunk}")
+                continue
+
+            hits, costs, records, exceeded = data
+
+            if budget:
+                budget.update(costs, records, exceeded)
+
+            for word_type, (word, variant, start) in hits.items():
+                result[word_type] = (word, get_pool_match(word, prepared, variant, start))
+    except Exception as e:
+        logger.warning(f"Get pool hits error: {e}", exc_info=True)
+        result = None
+
+    return result
+
+
+def get_pool_match(word: str, prepared: PreparedText, variant: str, start: int) -> Optional[Match]:
+    # Get the match found by a worker process
+    result = None
+    try:
+        if variant == "stripped":
+            text = prepared.get_stripped()
+        else:
+            text = prepared.get_collapsed()
+
+        pattern = compile_rule(word)
+        result = pattern.match(text, start) or pattern.search(text)
+    except Exception as e:
+        logger.warning(f"Get pool match error: {e}", exc_info=True)
+
+    return result
+
+
+def get_pool_rules(word_types: List[str], rule_sets: Dict[str, RuleSet],
+                   words: bool = False) -> List[Tuple[str, int, Optional[List[str]]]]:
+    # Get the rules sent to a worker process, the words are only sent when the worker has old rules
+    return [(word_type, rule_sets[word_type].version, rule_sets[word_type].words if words else None)
+            for word_type in word_types]
+
+
+def start_pool() -> bool:
+    # Start the process pool of the regex checks
+    try:
+        if not glovar.regex_processes:
+            return True
+
+        # Fork before any other thread starts, the workers do not load the data again
+        context = get_context("fork")
+        glovar.pool_cancel = context.Array("q", slots, lock=False)
+        glovar.pool_done = context.Array("q", slots, lock=False)
+        glovar.pool = context.Pool(glovar.regex_processes, init_worker, (glovar.pool_cancel, glovar.pool_done))
+
+        return True
+    except Exception as e:
+        logger.warning(f"Start pool error: {e}", exc_info=True)
+
+    return False
+
+
+def stop_pool() -> bool:
+    # Stop the process pool
+    try:
+        if not glovar.pool:
+            return True
+
+        glovar.pool.terminate()
+        glovar.pool = None
+
+        return True
+    except Exception as e:
+        logger.warning(f"Stop pool error: {e}", exc_info=True)
+
+    return False
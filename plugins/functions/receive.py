@@ -28,8 +28,10 @@ from .. import glovar
 from .channel import get_debug_text, share_data
 from .etc import code, crypt_str, general_link, get_int, get_text, lang, mention_id, thread
 from .file import crypt_file, data_to_file, delete_file, get_new_path, get_downloaded_path, save
+from .filters import update_rule_sets
 from .group import get_config_text, leave_group
 from .ids import init_group_id, init_user_id
+from .regex import get_special_pattern, get_special_table
 from .telegram import send_message, send_report_message
 from .timers import update_admins
 
@@ -338,6 +340,7 @@ def receive_refresh(client: Bot, data: int) -> bool:
 
 def receive_regex(client: Bot, message: Message, data: str) -> bool:
     # Receive regex
+    updated = ""
     glovar.locks["regex"].acquire()
     try:
         file_name = data
@@ -361,11 +364,18 @@ def receive_regex(client: Bot, message: Message, data: str) -> bool:
             eval(f"glovar.{file_name}")[word] = 0
 
         save(file_name)
+        updated = word_type if pop_set or new_set else ""
+
+        # Release the quarantined rules, REGEX has sent the rules again
+        if glovar.regex_quarantine.pop(word_type, None):
+            updated = word_type
+
+        glovar.regex_slow_times.pop(word_type, None)
 
         # Regenerate special characters dictionary if possible
         if file_name in {"spc_words", "spe_words"}:
             special = file_name.split("_")[0]
-            exec(f"glovar.{special}_dict = {{}}")
+            special_dict = {}
 
             for rule in words_data:
                 # Check keys
@@ -380,7 +390,12 @@ def receive_regex(client: Bot, message: Message, data: str) -> bool:
                 value = rule.split("?#")[1][1]
 
                 for k in keys:
-                    eval(f"glovar.{special}_dict")[k] = value
+                    special_dict[k] = value
+
+            exec(f"glovar.{special}_dict = special_dict")
+            special_table = get_special_table(glovar.spc_dict, glovar.spe_dict)
+            glovar.special_pattern = get_special_pattern(special_table)
+            glovar.special_table = special_table
 
         return True
     except Exception as e:
@@ -388,6 +403,14 @@ def receive_regex(client: Bot, message: Message, data: str) -> bool:
     finally:
         glovar.locks["regex"].release()
 
+        # Compile the added rules without blocking the checks
+        if updated:
+            update_rule_sets([updated])
+
+        # The names may be normalized differently
+        with glovar.locks["name"]:
+            glovar.names.clear()
+
     return False
 
 
@@ -494,6 +517,10 @@ def receive_rollback(client: Bot, message: Message, data: dict) -> bool:
         exec(f"glovar.{the_type} = the_data")
         save(the_type)
 
+        # Recompile the rules if possible
+        if the_type.endswith("_words") and the_type.split("_")[0] in glovar.regex:
+            update_rule_sets([the_type.split("_")[0]])
+
         # Send debug message
         text = (f"{lang('project')}{lang('colon')}{general_link(glovar.project_name, glovar.project_link)}\n"
                 f"{lang('admin_project')}{lang('colon')}{mention_id(aid)}\n"
@@ -0,0 +1,1350 @@
+# SCP-079-LONG - Control super long messages
+# Copyright (C) 2019-2020 SCP-079 <https://scp-079.org>
+#
+# This file is part of SCP-079-LONG.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import _sre
+import logging
+import re
+import sys
+from bisect import bisect_left
+from heapq import merge
+from itertools import count
+from signal import SIG_IGN, SIGINT, signal
+from string import ascii_lowercase
+from threading import Lock
+from time import perf_counter
+from types import MappingProxyType
+from typing import Any, Callable, Container, Dict, Iterable, List, Match, Optional, Pattern, Set, Tuple, Union
+
+try:
+    from re import _compiler as sre_compile, _parser as sre_parse
+except ImportError:
+    import sre_compile
+    import sre_parse
+
+try:
+    import re2
+except ImportError:
+    re2 = None
+
+# This module must not import glovar, it is used while glovar is loading
+
+# Enable logging
+logger = logging.getLogger(__name__)
+
+# Flags used by all regex rules
+flags: int = re.I | re.M | re.S
+
+# Case folding of the casefold pre-pass, built on the first use
+# The folded forms that the characters equal to a cased character may have in a folded text, as {code: (code)}
+case_images: Dict[int, Tuple[int, ...]] = {}
+
+# Cased characters in order
+case_points: List[int] = []
+
+# Characters that str.lower() does not fold to the right form, as {code: folded character}
+case_table: Dict[int, str] = {}
+
+# Pattern of the characters in the case table
+case_special: Optional[Pattern] = None
+
+# The last folded text, as (text, folded text)
+case_cache: Tuple[Optional[str], str] = (None, "")
+
+# Comments of the rules, RE2 does not support them
+comments: Pattern = re.compile(r"\(\?#[^)]*\)")
+
+# Available regex engines
+engines: Set[str] = {"re"} | ({"re2"} if re2 else set())
+
+# Options of RE2, the unsupported rules are expected
+options: Any = None
+
+if re2:
+    options = re2.Options()
+    options.log_errors = False
+
+# Type of the patterns compiled by re
+re_type: type = type(re.compile(""))
+
+# Versions of the compiled rule sets
+versions: Any = count(1)
+
+# Rule sets of a worker process, as {word type: (version in the main process, RuleSet)}
+worker_sets: Dict[str, Tuple[int, Any]] = {}
+
+# Rule bundles of a worker process, as {word types: (versions in the main process, RuleBundle)}
+worker_bundles: Dict[Tuple[str, ...], Tuple[Tuple[int, ...], Any]] = {}
+
+# Cancelled scans shared with the main process, as an array of scan ids
+worker_cancel: Any = None
+
+# Word types with hits shared with the main process, as an array of bit masks of the positions in the scans
+worker_done: Any = None
+
+# Positions of the word types with a bit in the masks
+done_bits: int = 63
+
+# A compiled rule, as (word, pattern, nocr)
+Rule = Tuple[str, Pattern, bool]
+
+# Characters that IGNORECASE treats as equal but str.casefold() does not
+fold_table: Dict[int, str] = {
+    0x130: "i",
+    0x131: "i",
+    0x1FD3: "\u0390",
+    0x1FE3: "\u03B0"
+}
+
+# Repeat operators of the regex parser
+repeats: Set[Any] = {getattr(sre_parse, op) for op in ["MAX_REPEAT", "MIN_REPEAT", "POSSESSIVE_REPEAT"]
+                     if hasattr(sre_parse, op)}
+
+# Characters that IGNORECASE of re treats as i
+i_table: Dict[int, str] = {
+    0x130: "i",
+    0x131: "i"
+}
+
+# Operators whose matches depend on the text around, the rules containing them can not be scanned by windows
+contextual: Set[Any] = {sre_parse.AT, sre_parse.ASSERT, sre_parse.ASSERT_NOT, sre_parse.GROUPREF_EXISTS}
+
+# Rules containing these can not be merged into an alternation
+unmergeable: Pattern = re.compile(r"\\[1-9]|\(\?P=|\(\?\(|\(\?[aiLmsux]+\)")
+
+# Word types of the filters, in the order of checking
+ad_types: List[str] = [f"ad{c}" for c in ascii_lowercase]
+con_types: List[str] = ["con", "iml", "pho"]
+ban_types: List[str] = ["ban", "ad"] + con_types + ad_types
+nm_types: List[str] = ["nm", "bio"]
+wb_types: List[str] = ["wb", "ad", "iml", "pho", "sho", "spc"] + [t for t in ad_types if t != "adi"]
+
+# Rules containing these have a different meaning in RE2: ASCII classes, "{,n}" and POSIX classes
+unsupported: Pattern = re.compile(r"\\[dDwWsSbB]|\{,|\[:")
+
+
+class Automaton:
+    # Aho-Corasick automaton, find all the literals in a text with one pass
+    def __init__(self, literals: Iterable[str]):
+        # Transitions, failure links and outputs of each state
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.output: List[Tuple[str, ...]] = [()]
+
+        for literal in set(literals):
+            state = 0
+
+            for c in literal:
+                new = self.goto[state].get(c)
+
+                if new is None:
+                    new = len(self.goto)
+                    self.goto[state][c] = new
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append(())
+
+                state = new
+
+            self.output[state] += (literal,)
+
+        # Breadth-first, so the failure state is always finished before
+        queue = list(self.goto[0].values())
+
+        for state in queue:
+            for c, new in self.goto[state].items():
+                queue.append(new)
+                fail = self.fail[state]
+
+                while fail and c not in self.goto[fail]:
+                    fail = self.fail[fail]
+
+                self.fail[new] = self.goto[fail].get(c, 0)
+                self.output[new] += self.output[self.fail[new]]
+
+    def search(self, text: str) -> Set[str]:
+        # Get the literals that the text contains
+        result = set()
+        try:
+            goto = self.goto
+            fail = self.fail
+            output = self.output
+            state = 0
+
+            for c in text:
+                while state and c not in goto[state]:
+                    state = fail[state]
+
+                state = goto[state].get(c, 0)
+
+                if output[state]:
+                    result.update(output[state])
+        except Exception as e:
+            logger.warning(f"Automaton search error: {e}", exc_info=True)
+
+        return result
+
+
+class Budget:
+    # Time budget of the regex checks, records the slow rules
+    def __init__(self, seconds: float = 0.0, slow: float = 0.0):
+        # Deadline of the checks, 0 means no limit
+        self.deadline: float = seconds and perf_counter() + seconds
+
+        # Cost of a single search that makes the rule slow, 0 means no record
+        self.slow: float = slow
+
+        # Whether the budget is used up
+        self.exceeded: bool = False
+
+        # Slow rules, as {(word type, word): the highest cost}
+        self.records: Dict[Tuple[str, str], float] = {}
+
+        # Costs of all the searched rules, as {(word type, word): [calls, total cost, the highest cost]}
+        self.costs: Dict[Tuple[str, str], List[float]] = {}
+
+        # Function telling whether the checks are cancelled
+        self.cancel: Optional[Callable[[], bool]] = None
+
+    def record(self, start: float, word_type: str = "", word: str = "") -> bool:
+        # Record the cost of a search started at the time, return False if the budget is used up
+        now = perf_counter()
+        cost = now - start
+
+        if word:
+            key = (word_type, word)
+            costs = self.costs.get(key)
+
+            if costs is None:
+                self.costs[key] = [1, cost, cost]
+            else:
+                costs[0] += 1
+                costs[1] += cost
+                costs[2] = max(costs[2], cost)
+
+            if self.slow and cost >= self.slow:
+                self.records[key] = max(self.records.get(key, 0.0), cost)
+
+        if self.deadline and now >= self.deadline:
+            self.exceeded = True
+
+        if self.cancel and self.cancel():
+            self.exceeded = True
+
+        return not self.exceeded
+
+    def update(self, costs: Dict[Tuple[str, str], List[float]], records: Dict[Tuple[str, str], float],
+               exceeded: bool) -> bool:
+        # Add the records of another budget, such as the budget of a worker process
+        for key, (calls, total, worst) in costs.items():
+            one = self.costs.get(key)
+
+            if one is None:
+                self.costs[key] = [calls, total, worst]
+            else:
+                one[0] += calls
+                one[1] += total
+                one[2] = max(one[2], worst)
+
+        for key, cost in records.items():
+            self.records[key] = max(self.records.get(key, 0.0), cost)
+
+        self.exceeded = self.exceeded or exceeded
+
+        return True
+
+
+class FoldPattern:
+    # A rule compiled without IGNORECASE, checked on the case folded text
+    def __init__(self, compiled: Pattern):
+        # The rule compiled for the folded texts
+        self.compiled: Pattern = compiled
+
+        # Named groups of the rule
+        self.groupindex: Dict[str, int] = compiled.groupindex
+
+    def match(self, text: str, pos: int = 0) -> Optional[Match]:
+        # Match the text at the position
+        return self.compiled.match(fold_case(text), pos)
+
+    def search(self, text: str, pos: int = 0, endpos: int = None) -> Optional[Match]:
+        # Search the text
+        if endpos is None:
+            return self.compiled.search(fold_case(text), pos)
+
+        return self.compiled.search(fold_case(text), pos, endpos)
+
+
+class Re2Pattern:
+    # A rule compiled by RE2, with the case folding of re
+    def __init__(self, regexp: Any):
+        # The compiled RE2 regexp
+        self.regexp: Any = regexp
+
+        # Named groups of the rule
+        self.groupindex: Dict[str, int] = regexp.groupindex
+
+    def match(self, text: str, pos: int = 0) -> Optional[Match]:
+        # Match the text at the position
+        return self.regexp.match(fold_i(text), pos)
+
+    def search(self, text: str, pos: int = 0, endpos: int = None) -> Optional[Match]:
+        # Search the text
+        return self.regexp.search(fold_i(text), pos, endpos)
+
+
+class PreparedText:
+    # A text with the variants used by the regex checks, each variant is computed once
+    def __init__(self, text: str):
+        # The original text
+        self.text: str = text
+
+        # Whitespace variants, as {variant: text}
+        self.variants: Dict[str, str] = {}
+
+        # Folded texts for the literal prefilter, as {text: folded text}
+        self.folded: Dict[str, str] = {}
+
+        # Checked word types, as {(word type, ocr): (word, match) or None}
+        self.hits: Dict[Tuple[str, bool], Optional[Tuple[str, Match]]] = {}
+
+    def get_collapsed(self) -> str:
+        # Get the text with continuous whitespace collapsed to a single space
+        result = self.variants.get("collapsed")
+
+        if result is None:
+            result = re.sub(r"\s{2,}", " ", self.text)
+            self.variants["collapsed"] = result
+
+        return result
+
+    def get_folded(self, text: str) -> str:
+        # Get the folded text of a variant
+        result = self.folded.get(text)
+
+        if result is None:
+            result = fold_text(text)
+            self.folded[text] = result
+
+        return result
+
+    def get_stripped(self) -> str:
+        # Get the text without any whitespace
+        result = self.variants.get("stripped")
+
+        if result is None:
+            result = re.sub(r"\s", "", self.get_collapsed())
+            self.variants["stripped"] = result
+
+        return result
+
+
+class RuleSet:
+    # Compiled regex rules of a word type, the unchanged rules of the previous version are reused
+    def __init__(self, words: Iterable[str], combine: bool = False, prefilter: bool = False, word_type: str = "",
+                 engine: str = "re", casefold: bool = False, previous: "RuleSet" = None):
+        # Word type of the rules
+        self.word_type: str = word_type
+
+        # Engine of the rules
+        self.engine: str = engine
+
+        # Whether the rules are compiled by the casefold pre-pass if possible
+        self.casefold: bool = casefold
+
+        # Version of the compiled rules
+        self.version: int = next(versions)
+
+        # Source rules in order
+        self.words: List[str] = list(words)
+
+        # Version of the rule content, kept when only the order of the rules changes
+        self.content: int = self.version
+
+        if previous and set(previous.words) == set(self.words):
+            self.content = previous.content
+
+        if not previous or previous.engine != engine or previous.casefold != casefold:
+            previous = None
+
+        # Rules in order
+        self.rules: List[Rule] = compile_rules(self.words, engine, previous and previous.rules, casefold)
+
+        # Required literals of each rule, as {word: literals}
+        self.required: Dict[str, Tuple[str, ...]] = {}
+
+        # Rules that must be checked on every text, as indexes
+        self.always: List[int] = list(range(len(self.rules)))
+
+        # Literals that the matches must contain, as {literal: [index]}
+        self.literals: Dict[str, List[int]] = {}
+
+        # Prefilter of the rules with literals
+        self.prefilter: Optional[Automaton] = None
+
+        # Maximum widths of the matches, as {index: width or None}, filled when the rules are scanned by windows
+        self.widths: Dict[int, Optional[int]] = {}
+
+        if prefilter:
+            self.always = []
+
+            for i, rule in enumerate(self.rules):
+                literals = previous and previous.required.get(rule[0])
+
+                if literals is None:
+                    literals = get_literals(rule[0])
+
+                self.required[rule[0]] = literals
+
+                if not literals:
+                    self.always.append(i)
+                    continue
+
+                for literal in literals:
+                    self.literals.setdefault(literal, []).append(i)
+
+            self.prefilter = Automaton(self.literals)
+
+        # Combined matchers of the rules without literals, as {ocr: (matcher, merged rules, rest rules)}
+        self.combined: Dict[bool, Tuple[Optional[Pattern], List[Rule], List[Rule]]] = {}
+
+        if not combine:
+            return
+
+        for ocr in [False, True]:
+            rules = self.get_always(ocr)
+
+            # The combined matcher only depends on the rules without literals
+            if (previous and previous.combined.get(ocr)
+                    and [rule[0] for rule in previous.get_always(ocr)] == [rule[0] for rule in rules]):
+                self.combined[ocr] = previous.combined[ocr]
+            else:
+                self.combined[ocr] = combine_rules(rules, engine, casefold)
+
+    def get_always(self, ocr: bool = False) -> List[Rule]:
+        # Get the rules without literals
+        return [self.rules[i] for i in self.always if not (ocr and self.rules[i][2])]
+
+    def get_candidates(self, found: Set[str]) -> List[int]:
+        # Get the rules whose literals are found, as indexes in order
+        result = set()
+
+        for literal in found:
+            result.update(self.literals.get(literal, ()))
+
+        return sorted(result)
+
+    def scan(self, text: str, ocr: bool = False, window: Tuple[int, int] = None, found: Set[str] = None,
+             budget: Budget = None) -> Tuple[int, str, Optional[Match]]:
+        # Search the matches starting in the window, return the index of the hit rule, the rule and the match
+        # The rules without a bounded width are only searched when no window is given
+        try:
+            if self.prefilter and self.literals:
+                if found is None:
+                    found = self.prefilter.search(fold_text(text))
+
+                candidates = self.get_candidates(found)
+            else:
+                candidates = []
+
+            for i in merge(candidates, self.always):
+                word, pattern, nocr = self.rules[i]
+
+                if ocr and nocr:
+                    continue
+
+                if i not in self.widths:
+                    self.widths[i] = get_width(word)
+
+                width = self.widths[i]
+
+                if (window is None) != (width is None):
+                    continue
+
+                # The window is extended by the width, so a match starting in the window is never cut
+                span = window and (window[0], min(len(text), window[1] + width))
+                result = search_pattern(pattern, text, budget, self.word_type, word, span)
+
+                if result:
+                    return i, word, result
+        except Exception as e:
+            logger.warning(f"Rule set scan error: {e}", exc_info=True)
+
+        return -1, "", None
+
+    def search(self, text: str, ocr: bool = False, found: Set[str] = None,
+               budget: Budget = None) -> Tuple[str, Optional[Match]]:
+        # Search the text, return the hit rule and the match
+        try:
+            combined = self.combined.get(ocr)
+
+            # Rules with literals are only checked when the literals are found
+            if self.prefilter and self.literals:
+                if found is None:
+                    found = self.prefilter.search(fold_text(text))
+
+                candidates = self.get_candidates(found)
+            else:
+                candidates = []
+
+            if combined:
+                indexes = candidates
+            else:
+                indexes = merge(candidates, self.always)
+
+            for i in indexes:
+                word, pattern, nocr = self.rules[i]
+
+                if ocr and nocr:
+                    continue
+
+                result = search_pattern(pattern, text, budget, self.word_type, word)
+
+                if result:
+                    return word, result
+
+            if not combined:
+                return "", None
+
+            matcher, merged, rules = combined
+            result = matcher and search_pattern(matcher, text, budget)
+
+            if result:
+                return get_hit_rule(merged, text, result), result
+
+            for word, pattern, _ in rules:
+                result = search_pattern(pattern, text, budget, self.word_type, word)
+
+                if result:
+                    return word, result
+        except Exception as e:
+            logger.warning(f"Rule set search error: {e}", exc_info=True)
+
+        return "", None
+
+
+class RuleBundle:
+    # Compiled regex rules of several word types, checked together
+    def __init__(self, rule_sets: Dict[str, RuleSet], combine: bool = False, prefilter: bool = False,
+                 engine: str = "re", casefold: bool = False):
+        # Rule sets in the order of checking
+        self.rule_sets: Dict[str, RuleSet] = rule_sets
+
+        # Prefilter of all the literals
+        self.prefilter: Optional[Automaton] = None
+
+        if prefilter:
+            self.prefilter = Automaton(literal for rule_set in rule_sets.values() for literal in rule_set.literals)
+
+        # Combined matchers, as {ocr: (matcher, [(word type, merged rules, rest rules)])}
+        self.combined: Dict[bool, Tuple[Optional[Pattern], List[Tuple[str, List[Rule], List[Rule]]]]] = {}
+
+        # A single word type uses its own combined matcher
+        if not combine or len(rule_sets) < 2:
+            return
+
+        for ocr in [False, True]:
+            parts = []
+
+            # The rule sets keep their own groups, only the alternation of all the word types is compiled here
+            for word_type, rule_set in rule_sets.items():
+                if rule_set.combined.get(ocr):
+                    _, merged, rest = rule_set.combined[ocr]
+                else:
+                    merged, rest = split_rules(rule_set.get_always(ocr), engine)
+
+                parts.append((word_type, merged, rest))
+
+            self.combined[ocr] = (join_rules([rule for part in parts for rule in part[1]], engine, casefold), parts)
+
+    def search(self, text: str, ocr: bool = False, word_types: Iterable[str] = None,
+               folded: str = None, budget: Budget = None) -> Dict[str, Tuple[str, Match]]:
+        # Search the text, return the hit rule and the match of each hit word type
+        result = {}
+        try:
+            if word_types is None:
+                word_types = list(self.rule_sets)
+            else:
+                word_types = [word_type for word_type in word_types if word_type in self.rule_sets]
+
+            if self.prefilter:
+                found = self.prefilter.search(fold_text(text) if folded is None else folded)
+            else:
+                found = None
+
+            combined = self.combined.get(ocr)
+
+            if combined:
+                matcher, parts = combined
+                hit = matcher and search_pattern(matcher, text, budget)
+
+                for word_type, merged, rest in parts:
+                    if word_type not in word_types:
+                        continue
+
+                    # Without a hit, only the rules outside the alternation need to be checked
+                    if hit:
+                        rules = merged
+                    else:
+                        rule_set = self.rule_sets[word_type]
+                        rules = [rule_set.rules[i] for i in rule_set.get_candidates(found or set())]
+                        rules = [rule for rule in rules if not (ocr and rule[2])] + rest
+
+                    for word, pattern, _ in rules:
+                        if hit:
+                            one = pattern.match(text, hit.start())
+                        else:
+                            one = search_pattern(pattern, text, budget, word_type, word)
+
+                        if one:
+                            result[word_type] = (word, one)
+                            break
+
+                # Other word types may still hit after the leftmost position
+                if not hit:
+                    return result
+
+                word_types = [word_type for word_type in word_types if word_type not in result]
+
+            for word_type in word_types:
+                word, one = self.rule_sets[word_type].search(text, ocr, found, budget)
+
+                if one:
+                    result[word_type] = (word, one)
+        except Exception as e:
+            logger.warning(f"Rule bundle search error: {e}", exc_info=True)
+
+        return result
+
+
+class RuleStore:
+    # Registry of the compiled rule sets, readers take the current snapshot without locking
+    def __init__(self, rule_sets: Dict[str, RuleSet] = None):
+        # Version of the snapshot
+        self.version: int = 0
+
+        # Current snapshot, never changed in place, replaced as a whole by the writers
+        self.snapshot: MappingProxyType = MappingProxyType(dict(rule_sets or {}))
+
+        # Lock of the writers
+        self.lock: Lock = Lock()
+
+    def __contains__(self, word_type: str) -> bool:
+        return word_type in self.snapshot
+
+    def __getitem__(self, word_type: str) -> RuleSet:
+        return self.snapshot[word_type]
+
+    def get(self, word_type: str) -> Optional[RuleSet]:
+        # Get the rule set of the word type
+        return self.snapshot.get(word_type)
+
+    def get_snapshot(self, word_types: Iterable[str]) -> Dict[str, RuleSet]:
+        # Get the rule sets of the word types from the same snapshot
+        snapshot = self.snapshot
+        return {word_type: snapshot[word_type] for word_type in word_types}
+
+    def publish(self, word_type: str, rule_set: RuleSet, old: Optional[RuleSet] = None) -> bool:
+        # Swap in a new snapshot with the rule set, fail if the rule set has been replaced since old was taken
+        with self.lock:
+            if self.snapshot.get(word_type) is not old:
+                return False
+
+            snapshot = dict(self.snapshot)
+            snapshot[word_type] = rule_set
+            self.snapshot = MappingProxyType(snapshot)
+            self.version += 1
+
+        return True
+
+
+def combine_rules(rules: List[Rule], engine: str = "re",
+                  casefold: bool = False) -> Tuple[Optional[Pattern], List[Rule], List[Rule]]:
+    # Merge rules into one alternation, return the matcher, the merged rules and the rest rules
+    try:
+        merged, rest = split_rules(rules, engine)
+        matcher = join_rules(merged, engine, casefold)
+
+        if matcher:
+            return matcher, merged, rest
+    except Exception as e:
+        logger.warning(f"Combine rules error: {e}", exc_info=True)
+
+    return None, [], rules
+
+
+def compile_fold(word: str) -> Optional[Pattern]:
+    # Compile a rule without IGNORECASE for the folded texts, return None if the rule can not keep the same meaning
+    result = None
+    try:
+        if not init_case():
+            return None
+
+        parsed = sre_parse.parse(word, flags & ~re.I)
+        state = getattr(parsed, "state", None) or parsed.pattern
+
+        if state.flags & re.I:
+            return None
+
+        cased = fold_parsed(parsed)
+
+        if cased is None:
+            return None
+
+        result = sre_compile.compile(parsed, flags & ~re.I)
+
+        # A rule without any cased character does not need the folded text
+        if cased:
+            result = FoldPattern(result)
+    except Exception as e:
+        logger.info(f"Compile rule {word} with casefold error: {e}")
+
+    return result
+
+
+def compile_re2(word: str) -> Optional[Pattern]:
+    # Compile a rule with RE2, return None if RE2 can not run the rule with the same meaning
+    result = None
+    try:
+        if not re2 or unsupported.search(word):
+            return None
+
+        result = Re2Pattern(re2.compile(f"(?ims:{fold_i(comments.sub('', word))})", options))
+    except Exception as e:
+        logger.info(f"Compile rule {word} with RE2 error: {e}")
+
+    return result
+
+
+def compile_rule(word: str, engine: str = "re", casefold: bool = False) -> Optional[Pattern]:
+    # Compile a regex rule, the rule is always checked by re, and falls back to re if the engine can not run it
+    result = None
+    try:
+        result = re.compile(word, flags)
+
+        if engine == "re2":
+            result = compile_re2(word) or result
+
+        # Rules run by re keep IGNORECASE if they can not be folded
+        if casefold and get_engine(result) == "re":
+            result = compile_fold(word) or result
+    except Exception as e:
+        logger.warning(f"Compile rule {word} error: {e}", exc_info=True)
+
+    return result
+
+
+def compile_rules(words: Iterable[str], engine: str = "re", known: List[Rule] = None,
+                  casefold: bool = False) -> List[Rule]:
+    # Compile the rules of a word type, keep the order, record the nocr flag, reuse the known rules
+    result = []
+    try:
+        known = {rule[0]: rule for rule in known or []}
+
+        for word in list(words):
+            if word in known:
+                result.append(known[word])
+                continue
+
+            pattern = compile_rule(word, engine, casefold)
+
+            if not pattern:
+                continue
+
+            result.append((word, pattern, "(?# nocr)" in word))
+    except Exception as e:
+        logger.warning(f"Compile rules error: {e}", exc_info=True)
+
+    return result
+
+
+def fold_case(text: str) -> str:
+    # Fold the text for the rules compiled by the casefold pre-pass, the length is kept
+    global case_cache
+
+    cache = case_cache
+
+    if cache[0] is text:
+        return cache[1]
+
+    result = text
+
+    if case_special.search(result):
+        result = result.translate(case_table)
+
+    result = result.lower()
+    case_cache = (text, result)
+
+    return result
+
+
+def fold_chars(codes: Iterable[int]) -> List[Tuple[int, int]]:
+    # Get the literals of the folded forms of the characters
+    result = set()
+
+    for code in codes:
+        result.update(case_images.get(code, (code,)))
+
+    return [(sre_parse.LITERAL, code) for code in sorted(result)]
+
+
+def fold_i(text: str) -> str:
+    # IGNORECASE of re treats İ and ı as i, RE2 does not, replace them in both the rules and the texts
+    if "\u0130" not in text and "\u0131" not in text:
+        return text
+
+    return text.translate(i_table)
+
+
+def fold_parsed(data: Any) -> Optional[bool]:
+    # Fold the cased characters of a parsed pattern in place, return whether any is found, None if it can not be folded
+    result = False
+
+    for i, (op, av) in enumerate(data):
+        if op in {sre_parse.LITERAL, sre_parse.NOT_LITERAL}:
+            if av not in case_images:
+                continue
+
+            literals = fold_chars([av])
+
+            if len(literals) == 1:
+                data[i] = (op, literals[0][1])
+            elif op == sre_parse.LITERAL:
+                data[i] = (sre_parse.IN, literals)
+            else:
+                data[i] = (sre_parse.IN, [(sre_parse.NEGATE, None)] + literals)
+
+            result = True
+            continue
+
+        if op == sre_parse.IN:
+            items = []
+
+            for item_op, item_av in av:
+                if item_op == sre_parse.LITERAL and item_av in case_images:
+                    items.extend(fold_chars([item_av]))
+                    result = True
+                elif item_op == sre_parse.RANGE and has_cased(*item_av):
+                    # Large ranges with cased characters are left to IGNORECASE
+                    if item_av[1] - item_av[0] > 1024:
+                        return None
+
+                    items.extend(fold_chars(range(item_av[0], item_av[1] + 1)))
+                    result = True
+                else:
+                    items.append((item_op, item_av))
+
+            data[i] = (op, items)
+            continue
+
+        if op == sre_parse.SUBPATTERN:
+            # Scoped flags change the case matching
+            if (av[1] | av[2]) & re.I:
+                return None
+
+            children = [av[-1]]
+        elif op == getattr(sre_parse, "ATOMIC_GROUP", None):
+            children = [av]
+        elif op in repeats:
+            children = [av[2]]
+        elif op == sre_parse.BRANCH:
+            children = av[1]
+        elif op in {sre_parse.ASSERT, sre_parse.ASSERT_NOT}:
+            children = [av[1]]
+        elif op in {sre_parse.GROUPREF, sre_parse.GROUPREF_EXISTS}:
+            # Back references compare the case in a different way
+            return None
+        else:
+            children = []
+
+        for child in children:
+            cased = fold_parsed(child)
+
+            if cased is None:
+                return None
+
+            result = result or cased
+
+    return result
+
+
+def fold_text(text: str) -> str:
+    # Fold the text for the literal prefilter, as a superset of IGNORECASE
+    return text.translate(fold_table).casefold()
+
+
+def get_ban_verdict(hits: Container[str], emoji: Callable[[], bool]) -> Tuple[bool, List[str]]:
+    # Get the ban verdict of the hit word types, with the word types credited on the way, as is_ban_text checks
+    credited = []
+
+    def get_first(word_types: List[str]) -> str:
+        # Get the first hit word type in order, credit it
+        for word_type in word_types:
+            if word_type in hits:
+                credited.append(word_type)
+                return word_type
+
+        return ""
+
+    if get_first(["ban"]):
+        return True, credited
+
+    # ad + con
+    ad = get_first(["ad"])
+    con = get_first(con_types)
+
+    if ad and con:
+        return True, credited
+
+    # emoji + con
+    emoji = emoji()
+
+    if emoji and con:
+        return True, credited
+
+    # ad_ + con
+    ad = get_first(ad_types)
+
+    if ad and con:
+        return True, credited
+
+    # ad_ + emoji
+    if ad and emoji:
+        return True, credited
+
+    # ad_ + ad_
+    if ad:
+        return bool(get_first([word_type for word_type in ad_types if word_type != ad])), credited
+
+    return False, credited
+
+
+def get_engine(pattern: Pattern) -> str:
+    # Get the engine of the compiled pattern
+    if isinstance(pattern, Re2Pattern):
+        return "re2"
+
+    return "re"
+
+
+def get_hit_rule(rules: List[Rule], text: str, result: Match) -> str:
+    # Get the rule which produced the combined match
+    try:
+        # The alternation takes the first branch that matches at the leftmost position
+        start = result.start()
+
+        for word, pattern, _ in rules:
+            if pattern.match(text, start):
+                return word
+    except Exception as e:
+        logger.warning(f"Get hit rule error: {e}", exc_info=True)
+
+    return ""
+
+
+def get_literals(word: str) -> Tuple[str, ...]:
+    # Get the folded literals of the rule, any match of the rule contains one of them at least
+    result = ()
+    try:
+        literals = get_required(sre_parse.parse(word, flags))
+        result = tuple(fold_text(literal) for literal in literals)
+    except Exception as e:
+        logger.warning(f"Get literals of {word} error: {e}", exc_info=True)
+
+    return result
+
+
+def get_nm_verdict(hits: Container[str], emoji: Callable[[], bool]) -> Tuple[bool, List[str]]:
+    # Get the nm verdict of the hit word types, with the word types credited on the way, as is_nm_text checks
+    for word_type in nm_types:
+        if word_type in hits:
+            return True, [word_type]
+
+    return get_ban_verdict(hits, emoji)
+
+
+def get_prepared(text: Union[str, PreparedText]) -> PreparedText:
+    # Get the prepared text, reuse it if the text is already prepared
+    if isinstance(text, PreparedText):
+        return text
+
+    return PreparedText(text or "")
+
+
+def get_required(data: Iterable[Tuple[int, Any]]) -> Tuple[str, ...]:
+    # Get the required literals of a parsed pattern, choose the most selective one
+    candidates = []
+    literal = ""
+
+    for op, av in data:
+        if op == sre_parse.LITERAL:
+            literal += chr(av)
+            continue
+
+        if literal:
+            candidates.append((literal,))
+            literal = ""
+
+        if op == sre_parse.SUBPATTERN:
+            required = get_required(av[-1])
+        elif op == getattr(sre_parse, "ATOMIC_GROUP", None):
+            required = get_required(av)
+        elif op in repeats and av[0] >= 1:
+            required = get_required(av[2])
+        elif op == sre_parse.BRANCH:
+            branches = [get_required(branch) for branch in av[1]]
+
+            if all(branches):
+                required = tuple(one for branch in branches for one in branch)
+            else:
+                required = ()
+        else:
+            required = ()
+
+        if required:
+            candidates.append(required)
+
+    if literal:
+        candidates.append((literal,))
+
+    if not candidates:
+        return ()
+
+    return max(candidates, key=lambda x: (min(len(one) for one in x), -len(x)))
+
+
+def get_special_pattern(table: Dict[int, str]) -> Optional[Pattern]:
+    # Get the pattern of the characters in the translation table
+    if not table:
+        return None
+
+    return re.compile("[" + "".join(re.escape(chr(k)) for k in sorted(table)) + "]")
+
+
+def get_special_table(spc_dict: Dict[str, str], spe_dict: Dict[str, str]) -> Dict[int, str]:
+    # Get the translation table of the special characters, the spc rules go first
+    result = {}
+
+    for k in set(spc_dict) | set(spe_dict):
+        value = spc_dict.get(k, k)
+        value = spe_dict.get(value, value)
+
+        if value != k:
+            result[ord(k)] = value
+
+    return result
+
+
+def get_wb_verdict(hits: Container[str]) -> Tuple[bool, List[str]]:
+    # Get the wb verdict of the hit word types, with the word types credited on the way, as is_wb_text checks
+    for word_type in wb_types:
+        if word_type in hits:
+            return True, [word_type]
+
+    return False, []
+
+
+def get_width(word: str) -> Optional[int]:
+    # Get the maximum width of the matches of the rule, None if it is unbounded or depends on the text around
+    result = None
+    try:
+        parsed = sre_parse.parse(word, flags)
+
+        if has_context(parsed):
+            return None
+
+        width = parsed.getwidth()[1]
+
+        if width < sre_parse.MAXREPEAT - 1:
+            result = width
+    except Exception as e:
+        logger.warning(f"Get width of {word} error: {e}", exc_info=True)
+
+    return result
+
+
+def get_worker_bundle(rules: List[Tuple[str, int, Optional[List[str]]]],
+                      settings: Tuple[bool, bool, str, bool]) -> Tuple[List[str], Optional[RuleBundle]]:
+    # Get the rule bundle of a worker process, return the word types whose words are needed instead if any
+    combine, prefilter, engine, casefold = settings
+    stale = []
+
+    for word_type, version, words in rules:
+        if worker_sets.get(word_type, (0,))[0] == version:
+            continue
+
+        if words is None:
+            stale.append(word_type)
+            continue
+
+        previous = worker_sets.get(word_type, (0, None))[1]
+        worker_sets[word_type] = (version, RuleSet(words, combine, prefilter, word_type, engine, casefold, previous))
+
+    if stale:
+        return stale, None
+
+    word_types = tuple(word_type for word_type, _, _ in rules)
+    key = tuple(version for _, version, _ in rules)
+    bundle = worker_bundles.get(word_types, ((), None))
+
+    if bundle[0] != key:
+        bundle = (key, RuleBundle({word_type: worker_sets[word_type][1] for word_type in word_types},
+                                  combine, prefilter, engine, casefold))
+        worker_bundles[word_types] = bundle
+
+    return [], bundle[1]
+
+
+def has_cased(low: int, high: int) -> bool:
+    # Check if any cased character is in the range
+    i = bisect_left(case_points, low)
+
+    return i < len(case_points) and case_points[i] <= high
+
+
+def has_context(data: Iterable[Tuple[int, Any]]) -> bool:
+    # Check if the matches of a parsed pattern depend on the text around
+    for op, av in data:
+        if op in contextual:
+            return True
+
+        if op == sre_parse.SUBPATTERN:
+            children = [av[-1]]
+        elif op == getattr(sre_parse, "ATOMIC_GROUP", None):
+            children = [av]
+        elif op in repeats:
+            children = [av[2]]
+        elif op == sre_parse.BRANCH:
+            children = av[1]
+        else:
+            children = []
+
+        if any(has_context(child) for child in children):
+            return True
+
+    return False
+
+
+def init_case() -> bool:
+    # Build the case folding of the casefold pre-pass from the one of IGNORECASE, return False if it is not available
+    global case_special
+
+    if case_points:
+        return True
+
+    tolower = getattr(_sre, "unicode_tolower", None)
+    fixes = getattr(sre_compile, "_EXTRA_CASES", None) or getattr(sre_compile, "_ignorecase_fixes", None)
+
+    if not tolower or fixes is None:
+        return False
+
+    # Characters equal to each other, as {lower code: {code}}
+    groups: Dict[int, Set[int]] = {}
+
+    for code in range(sys.maxunicode + 1):
+        lower = tolower(code)
+
+        if lower != code:
+            groups.setdefault(lower, {lower}).add(code)
+
+    for lower, others in fixes.items():
+        group = set().union(*[groups.get(one, {one}) for one in (lower,) + tuple(others)])
+
+        for one in (lower,) + tuple(others):
+            groups[one] = group
+
+    # The characters are folded within the same kind, so \w, \s and \d still work on the folded text
+    def kind(one: int) -> Tuple[bool, bool, bool]:
+        char = chr(one)
+        return char.isalnum() or char == "_", char.isspace(), char.isdecimal()
+
+    for group in {id(group): group for group in groups.values()}.values():
+        folded = {}
+
+        for code in sorted(group):
+            folded.setdefault(kind(code), []).append(code)
+
+        folded = {key: min(codes, key=lambda x: (chr(x).lower() != chr(x), x)) for key, codes in folded.items()}
+        images = tuple(sorted(set(folded.values())))
+
+        for code in group:
+            case_images[code] = images
+            target = folded[kind(code)]
+
+            # The final sigma is lowered by its context
+            if chr(code).lower() != chr(target) or code == 0x3A3:
+                case_table[code] = chr(target)
+
+    case_points.extend(sorted(case_images))
+    case_special = re.compile("[" + "".join(re.escape(chr(code)) for code in case_table) + "]")
+
+    return True
+
+
+def init_worker(cancel: Any = None, done: Any = None) -> None:
+    # Initialize a worker process, leave the signals to the main process
+    global worker_cancel, worker_done
+    worker_cancel = cancel
+    worker_done = done
+    signal(SIGINT, SIG_IGN)
+
+
+def join_rules(rules: List[Rule], engine: str = "re", casefold: bool = False) -> Optional[Pattern]:
+    # Join the rules into one alternation
+    result = None
+    try:
+        if not rules:
+            return None
+
+        # Named groups would disable the prefix check of sre, so the hit rule is found after matching
+        result = compile_rule("|".join(f"(?:{word})" for word, _, _ in rules), engine, casefold)
+    except Exception as e:
+        logger.warning(f"Join rules error: {e}", exc_info=True)
+
+    return result
+
+
+def scan_worker(rules: List[Tuple[str, int, Optional[List[str]]]], text: str, ocr: bool,
+                settings: Tuple[bool, bool, str, bool], limits: Optional[Tuple[float, float]],
+                window: Optional[Tuple[int, int]], scan: Tuple[int, int],
+                found: Set[str] = None) -> Tuple[str, Any]:
+    # Search the matches starting in a window of the text in a worker process, the scan is given as (slot, scan id)
+    # The literals found in the whole text are given by the main process, the word types with hits are skipped
+    # Return ("stale", [word type]), ("cancelled", None) or ("hits", (hits, costs, records, exceeded)),
+    # the hits are given as {word type: (index of the rule, word, start)}
+    try:
+        slot, scan_id = scan
+
+        def cancel() -> bool:
+            return worker_cancel is not None and worker_cancel[slot] == scan_id
+
+        def is_done(position: int) -> bool:
+            return worker_done is not None and position < done_bits and bool(worker_done[slot] >> position & 1)
+
+        if cancel():
+            return "cancelled", None
+
+        stale, bundle = get_worker_bundle(rules, settings)
+
+        if stale:
+            return "stale", stale
+
+        budget = Budget(*limits) if limits else Budget()
+        budget.cancel = cancel
+        if found is None and bundle.prefilter:
+            found = bundle.prefilter.search(fold_text(text))
+
+        hits = {}
+
+        for position, (word_type, _, _) in enumerate(rules):
+            if is_done(position):
+                continue
+
+            rule_set = bundle.rule_sets[word_type]
+            i, word, result = rule_set.scan(text, ocr, window, found, budget)
+
+            if result:
+                hits[word_type] = (i, word, result.start())
+
+        if cancel():
+            return "cancelled", None
+
+        if not limits:
+            return "hits", (hits, {}, {}, False)
+
+        return "hits", (hits, budget.costs, budget.records, budget.exceeded)
+    except Exception as e:
+        logger.warning(f"Scan worker error: {e}", exc_info=True)
+
+    return "error", None
+
+
+def search_pattern(pattern: Pattern, text: str, budget: Budget = None, word_type: str = "", word: str = "",
+                   span: Tuple[int, int] = None) -> Optional[Match]:
+    # Search the text with the pattern within the budget, only the span of the text if given
+    span = span or ()
+
+    if budget is None:
+        return pattern.search(text, *span)
+
+    if budget.exceeded:
+        return None
+
+    start = perf_counter()
+    result = pattern.search(text, *span)
+    budget.record(start, word_type, word)
+
+    return result
+
+
+def search_worker(rules: List[Tuple[str, int, Optional[List[str]]]], text: str, ocr: bool,
+                  settings: Tuple[bool, bool, str, bool],
+                  limits: Optional[Tuple[float, float]]) -> Tuple[str, Any]:
+    # Search the collapsed text in a worker process, rules are given as [(word type, version, words or None)]
+    # Return ("stale", [word type]) if the worker needs the words, or ("hits", (hits, costs, records, exceeded)),
+    # the hits are given as {word type: (word, variant, start)}
+    try:
+        stale, bundle = get_worker_bundle(rules, settings)
+
+        if stale:
+            return "stale", stale
+
+        word_types = [word_type for word_type, _, _ in rules]
+        budget = limits and Budget(*limits)
+        hits = {}
+
+        for word_type, (word, result) in bundle.search(text, ocr, budget=budget).items():
+            hits[word_type] = (word, "collapsed", result.start())
+
+        rest = [word_type for word_type in word_types if word_type not in hits]
+
+        # Try again
+        if rest and " " in text:
+            stripped = re.sub(r"\s", "", text)
+
+            for word_type, (word, result) in bundle.search(stripped, ocr, rest, budget=budget).items():
+                hits[word_type] = (word, "stripped", result.start())
+
+        if not budget:
+            return "hits", (hits, {}, {}, False)
+
+        return "hits", (hits, budget.costs, budget.records, budget.exceeded)
+    except Exception as e:
+        logger.warning(f"Search worker error: {e}", exc_info=True)
+
+    return "error", None
+
+
+def sort_words(words: Iterable[str], ranks: Dict[str, int]) -> List[str]:
+    # Sort the rules by their ranks, rules with the same rank keep the original order
+    return sorted(words, key=lambda word: -ranks.get(word, 0))
+
+
+def split_rules(rules: List[Rule], engine: str = "re") -> Tuple[List[Rule], List[Rule]]:
+    # Split the rules into the ones that can be merged into an alternation and the rest
+    merged = []
+    rest = []
+
+    for rule in rules:
+        word, pattern, _ = rule
+
+        if pattern.groupindex or unmergeable.search(word) or get_engine(pattern) != engine:
+            rest.append(rule)
+        else:
+            merged.append(rule)
+
+    return merged, rest
@@ -22,7 +22,7 @@ import re
 from telegram import Bot, Message
 
 from .. import glovar
-from .etc import code, get_text, lang, thread, mention_id
+from .etc import code, get_length, get_text, is_length_reached, lang, thread, mention_id
 from .telegram import send_message
 
 # Enable logging
@@ -44,14 +44,15 @@ def long_test(client: Bot, message: Message) -> bool:
         if not message_text:
             return True
 
-        # Get length
-        length = len(message_text.encode())
+        # Check length
+        if not is_length_reached(message_text, 1500):
+            return True
 
         # Send the result
-        if length >= 1500:
-            text = (f"{lang('admin')}{lang('colon')}{mention_id(aid)}\n\n"
-                    f"{lang('message_length')}{lang('colon')}{code(length)}\n")
-            thread(send_message, (client, glovar.test_group_id, text, message.message_id))
+        length = get_length(message_text)
+        text = (f"{lang('admin')}{lang('colon')}{mention_id(aid)}\n\n"
+                f"{lang('message_length')}{lang('colon')}{code(length)}\n")
+        thread(send_message, (client, glovar.test_group_id, text, message.message_id))
 
         return True
     except Exception as e:
@@ -22,9 +22,10 @@ from time import sleep
 from telegram import Bot
 
 from .. import glovar
-from .channel import share_data, share_regex_count
+from .channel import share_data, share_regex_count, share_regex_profile
 from .etc import code, general_link, lang, thread
-from .file import save
+from .file import save, save_thread
+from .filters import update_rule_sets
 from .group import leave_group
 from .telegram import get_admins, get_chat_member, get_group_info, send_message
 
@@ -103,11 +104,18 @@ def reset_data(client: Bot) -> bool:
 
 
 def send_count(client: Bot) -> bool:
-    # Send regex count to REGEX
+    # Send regex count and profile to REGEX
+    update_counts()
+
     glovar.locks["regex"].acquire()
     try:
+        with glovar.locks["count"]:
+            regex_profile = glovar.regex_profile
+            glovar.regex_profile = {}
+
         for word_type in glovar.regex:
             share_regex_count(client, word_type)
+            share_regex_profile(client, word_type, regex_profile.get(word_type, {}))
             word_list = list(eval(f"glovar.{word_type}_words"))
 
             for word in word_list:
@@ -115,6 +123,12 @@ def send_count(client: Bot) -> bool:
 
             save(f"{word_type}_words")
 
+            # Halve the ranks, so the order follows the recent hits
+            ranks = glovar.regex_ranks.get(word_type, {})
+            glovar.regex_ranks[word_type] = {word: ranks[word] // 2 for word in word_list if ranks.get(word, 0) > 1}
+
+        save("regex_ranks")
+
         return True
     except Exception as e:
         logger.warning(f"Send count error: {e}", exc_info=True)
@@ -217,6 +231,50 @@ def update_admins(client: Bot) -> bool:
     return False
 
 
+def update_counts(final: bool = False) -> bool:
+    # Merge the buffered regex counts into the word data and the ranks, then reorder the rules
+    # The final update on shutdown saves the files before returning and does not reorder the rules
+    result = False
+    word_types = []
+    save_file = save_thread if final else save
+
+    glovar.locks["regex"].acquire()
+    try:
+        with glovar.locks["count"]:
+            regex_counts = glovar.regex_counts
+            glovar.regex_counts = {}
+
+        for word_type in regex_counts:
+            words = eval(f"glovar.{word_type}_words")
+            ranks = glovar.regex_ranks.setdefault(word_type, {})
+
+            for word, count in regex_counts[word_type].items():
+                # The rule may be removed by REGEX
+                if word not in words:
+                    continue
+
+                words[word] += count
+                ranks[word] = ranks.get(word, 0) + count
+
+            save_file(f"{word_type}_words")
+            word_types.append(word_type)
+
+        if word_types:
+            save_file("regex_ranks")
+
+        result = True
+    except Exception as e:
+        logger.warning(f"Update counts error: {e}", exc_info=True)
+    finally:
+        glovar.locks["regex"].release()
+
+    # Compile the new orders without blocking the checks
+    if word_types and not final:
+        update_rule_sets(word_types)
+
+    return result
+
+
 def update_status(client: Bot, the_type: str) -> bool:
     # Update running status to BACKUP
     try:
@@ -21,12 +21,12 @@ import logging
 from telegram import Bot, ChatPermissions, Message
 
 from .. import glovar
-from .etc import crypt_str, get_forward_name, get_full_name, get_now, lang, thread
+from .etc import crypt_str, get_message_context, lang, thread
 from .channel import ask_for_help, declare_message, forward_evidence, send_debug, share_bad_user
 from .channel import share_watch_user, update_score
 from .file import save
 from .filters import is_class_d, is_declared_message, is_detected_user, is_high_score_user, is_limited_user, is_new_user
-from .filters import is_watch_user, is_wb_text
+from .filters import is_name_text, is_watch_user
 from .ids import init_user_id
 from .telegram import delete_message, kick_chat_member, restrict_chat_member
 
@@ -111,12 +111,15 @@ def terminate_user(client: Bot, message: Message, length: int) -> bool:
         gid = message.chat.id
         uid = message.from_user.id
         mid = message.message_id
-        now = int(message.date.strftime("%s")) or get_now()
+        context = get_message_context(message)
+        now = context.get_now()
 
-        full_name = get_full_name(message.from_user, True, True)
-        forward_name = get_forward_name(message, True, True)
+        full_name = context.get_full_name()
+        forward_name = context.get_forward_name()
+        name_wb = (is_name_text("wb", uid, full_name, lambda: context.get_full_name(True, True))
+                   or is_name_text("wb", uid, forward_name, lambda: context.get_forward_name(True, True)))
 
-        if (is_wb_text(full_name, False) or is_wb_text(forward_name, False)) and length != 79:
+        if name_wb and length != 79:
             result = forward_evidence(
                 client=client,
                 message=message,
@@ -18,18 +18,25 @@
 
 import logging
 import pickle
+import re
+from collections import OrderedDict
 from codecs import getdecoder
 from configparser import RawConfigParser
+from ctypes import Array
+from multiprocessing.pool import Pool
 from os import mkdir
 from os.path import exists
 from shutil import rmtree
 from string import ascii_lowercase
-from threading import Lock
-from typing import Dict, List, Set, Union
+from threading import Lock, local
+from typing import Dict, List, Optional, Pattern, Set, Tuple, Union
 
 from emoji import UNICODE_EMOJI
 from telegram import Chat
 
+from .functions.regex import RuleBundle, RuleSet, RuleStore, engines, get_special_pattern, get_special_table
+from .functions.regex import sort_words
+
 # Enable logging
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
@@ -101,6 +108,21 @@ emoji_wb_total: int = 0
 key: Union[bytes, str] = ""
 password: str = ""
 
+# [regex]
+regex_budget: float = 1.0
+regex_casefold: Union[bool, str] = "False"
+regex_chunk_length: int = 0
+regex_combine: Union[bool, str] = "False"
+regex_engine: str = "re"
+regex_prefilter: Union[bool, str] = "True"
+regex_process_length: int = 3000
+regex_processes: int = 0
+regex_quarantine_limit: int = 10
+regex_slow: float = 0.1
+regex_slow_limit: int = 3
+regex_slow_window: int = 600
+regex_timing: Union[bool, str] = "True"
+
 try:
     config = RawConfigParser()
     config.read("config.ini")
@@ -167,6 +189,25 @@ try:
     key = config["encrypt"].get("key", key)
     key = key.encode("utf-8")
     password = config["encrypt"].get("password", password)
+
+    # [regex]
+    regex_budget = float(config.get("regex", "regex_budget", fallback=str(regex_budget)))
+    regex_casefold = config.get("regex", "regex_casefold", fallback=regex_casefold)
+    regex_casefold = eval(regex_casefold)
+    regex_chunk_length = int(config.get("regex", "regex_chunk_length", fallback=str(regex_chunk_length)))
+    regex_combine = config.get("regex", "regex_combine", fallback=regex_combine)
+    regex_combine = eval(regex_combine)
+    regex_engine = config.get("regex", "regex_engine", fallback=regex_engine)
+    regex_prefilter = config.get("regex", "regex_prefilter", fallback=regex_prefilter)
+    regex_prefilter = eval(regex_prefilter)
+    regex_process_length = int(config.get("regex", "regex_process_length", fallback=str(regex_process_length)))
+    regex_processes = int(config.get("regex", "regex_processes", fallback=str(regex_processes)))
+    regex_quarantine_limit = int(config.get("regex", "regex_quarantine_limit", fallback=str(regex_quarantine_limit)))
+    regex_slow = float(config.get("regex", "regex_slow", fallback=str(regex_slow)))
+    regex_slow_limit = int(config.get("regex", "regex_slow_limit", fallback=str(regex_slow_limit)))
+    regex_slow_window = int(config.get("regex", "regex_slow_window", fallback=str(regex_slow_window)))
+    regex_timing = config.get("regex", "regex_timing", fallback=regex_timing)
+    regex_timing = eval(regex_timing)
 except Exception as e:
     logger.warning(f"Read data from config.ini error: {e}", exc_info=True)
 
@@ -213,10 +254,27 @@ if (enabled not in {False, True}
         or emoji_wb_single == 0
         or emoji_wb_total == 0
         or key in {b"", b"[DATA EXPUNGED]", "", "[DATA EXPUNGED]"}
-        or password in {"", "[DATA EXPUNGED]"}):
+        or password in {"", "[DATA EXPUNGED]"}
+        or regex_budget < 0
+        or regex_casefold not in {False, True}
+        or regex_chunk_length < 0
+        or regex_combine not in {False, True}
+        or regex_engine not in {"re", "re2"}
+        or regex_prefilter not in {False, True}
+        or regex_process_length == 0
+        or regex_processes < 0
+        or regex_quarantine_limit < 0
+        or regex_slow < 0
+        or regex_slow_limit == 0
+        or regex_slow_window <= 0
+        or regex_timing not in {False, True}):
     logger.critical("No proper settings")
     raise SystemExit("No proper settings")
 
+if regex_engine not in engines:
+    logger.warning(f"Regex engine {regex_engine} is not installed, use re instead")
+    regex_engine = "re"
+
 if enabled:
     request_kwargs = {
         "proxy_url": f"socks5h://{hostname}:{port}/"
@@ -293,6 +351,15 @@ lang: Dict[str, str] = {
     # Message Types
     "gam": (zh_cn and "游戏") or "Game",
     "ser": (zh_cn and "服务消息") or "Service",
+    # Regex
+    "regex_quarantine": (zh_cn and "隔离正则规则") or "Quarantine Regex Rule",
+    "regex_type": (zh_cn and "规则类别") or "Rule Type",
+    "regex_cost": (zh_cn and "单次耗时") or "Time Cost",
+    "regex_slow": (zh_cn and "多次超时") or "Repeatedly Too Slow",
+    "regex_calls": (zh_cn and "调用 / 命中") or "Calls / Hits",
+    "regex_total": (zh_cn and "累计耗时") or "Total Time",
+    "regex_worst": (zh_cn and "最长耗时") or "Worst Time",
+    "regex_engine": (zh_cn and "引擎") or "Engine",
     # Record
     "project": (zh_cn and "项目编号") or "Project",
     "project_origin": (zh_cn and "原始项目") or "Original Project",
@@ -380,16 +447,71 @@ default_user_status: Dict[str, Dict[Union[int, str], Union[float, int]]] = {
 
 emoji_set: Set[str] = set(UNICODE_EMOJI)
 
+# Trie of the emoji not protected, as {char: {char: {...}, "": emoji}}
+emoji_trie: dict = {}
+
+for emoji in emoji_set:
+    if emoji in emoji_protect:
+        continue
+
+    node = emoji_trie
+
+    for char in emoji:
+        node = node.setdefault(char, {})
+
+    node[""] = emoji
+
+# Pattern of the first characters of the emoji, the text is only walked from these positions
+# The astral characters are covered by one range, re checks a long list of them one by one
+emoji_start: Optional[Pattern] = None
+
+if emoji_trie:
+    emoji_chars = [re.escape(char) for char in sorted(emoji_trie) if ord(char) <= 0xFFFF]
+    emoji_astral = [re.escape(char) for char in sorted(emoji_trie) if ord(char) > 0xFFFF]
+
+    if emoji_astral:
+        emoji_chars.append(f"{emoji_astral[0]}-{emoji_astral[-1]}")
+
+    emoji_start = re.compile("[" + "".join(emoji_chars) + "]")
+
 left_group_ids: Set[int] = set()
 
+memo: local = local()
+# memo.budget = Budget
+# memo.context = MessageContext
+# memo.credits = [(word_type, word)]
+# memo.texts = {
+#     "text": PreparedText
+# }
+
 locks: Dict[str, Lock] = {
     "admin": Lock(),
+    "count": Lock(),
     "message": Lock(),
+    "name": Lock(),
     "receive": Lock(),
     "regex": Lock(),
     "test": Lock()
 }
 
+names: OrderedDict = OrderedDict()
+# names = {
+#     (12345678, "name"): {
+#         "normal": "name",
+#         "verdicts": {
+#             "nm": ((3, 5, ...), False, [("nm", "word")])
+#         }
+#     }
+# }
+
+names_limit: int = 10000
+
+pool: Optional[Pool] = None
+
+pool_cancel: Optional[Array] = None
+
+pool_done: Optional[Array] = None
+
 receivers: Dict[str, List[str]] = {
     "bad": ["ANALYZE", "APPLY", "AVATAR", "CAPTCHA", "CLEAN", "LANG", "LONG", "MANAGE",
             "NOFLOOD", "NOPORN", "NOSPAM", "RECHECK", "TICKET", "TIP", "USER", "WARN", "WATCH"],
@@ -424,6 +546,35 @@ regex: Dict[str, bool] = {
 for c in ascii_lowercase:
     regex[f"ad{c}"] = False
 
+regex_counts: Dict[str, Dict[str, int]] = {}
+# regex_counts = {
+#     "ad": {
+#         "regex": 1
+#     }
+# }
+
+regex_profile: Dict[str, Dict[str, List[float]]] = {}
+# regex_profile = {
+#     "ad": {
+#         "regex": [1, 0.001, 0.001]
+#     }
+# }
+
+regex_quarantine: Dict[str, Set[str]] = {}
+# regex_quarantine = {
+#     "ad": {"regex"}
+# }
+
+regex_reports: List[Tuple[str, str, float]] = []
+# regex_reports = [("ad", "regex", 0.1)]
+
+regex_slow_times: Dict[str, Dict[str, List[int]]] = {}
+# regex_slow_times = {
+#     "ad": {
+#         "regex": [1512345678]
+#     }
+# }
+
 sender: str = "LONG"
 
 should_hide: bool = False
@@ -519,6 +670,13 @@ configs: Dict[int, Dict[str, Union[bool, int]]] = {}
 #     }
 # }
 
+regex_ranks: Dict[str, Dict[str, int]] = {}
+# regex_ranks = {
+#     "ad": {
+#         "regex": 1
+#     }
+# }
+
 # Init word variables
 
 for word_type in regex:
@@ -530,7 +688,7 @@ for word_type in regex:
 
 # Load data
 file_list: List[str] = ["admin_ids", "bad_ids", "except_ids", "trust_ids", "user_ids", "watch_ids",
-                        "configs"]
+                        "configs", "regex_ranks"]
 file_list += [f"{f}_words" for f in regex]
 
 for file in file_list:
@@ -570,6 +728,35 @@ for special in ["spc", "spe"]:
         for k in keys:
             locals()[f"{special}_dict"][k] = value
 
+# Translation table of the special characters
+special_table: Dict[int, str] = get_special_table(spc_dict, spe_dict)
+
+# Pattern of the characters in the translation table, texts without them are not translated
+special_pattern: Optional[Pattern] = get_special_pattern(special_table)
+
+# Compile regex rules
+rule_sets: Dict[str, RuleSet] = {}
+
+for word_type in regex:
+    rule_sets[word_type] = RuleSet(
+        words=sort_words(locals()[f"{word_type}_words"], regex_ranks.get(word_type, {})),
+        combine=regex_combine,
+        prefilter=regex_prefilter,
+        word_type=word_type,
+        engine=regex_engine,
+        casefold=regex_casefold
+    )
+
+compiled: RuleStore = RuleStore(rule_sets)
+# compiled = RuleStore({
+#     "ad": RuleSet
+# })
+
+bundles: Dict[tuple, RuleBundle] = {}
+# bundles = {
+#     ("con", "iml", "pho"): RuleBundle
+# }
+
 # Start program
 copyright_text = (f"SCP-079-{sender} v{version}, Copyright (C) 2019-2020 SCP-079 <https://scp-079.org>\n"
                   "Licensed under the terms of the GNU General Public License v3 or later (GPLv3+)\n")
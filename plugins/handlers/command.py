@@ -31,6 +31,7 @@ from ..functions.etc import get_readable_time, lang, thread, mention_id
 from ..functions.file import save
 from ..functions.filters import authorized_group, captcha_group, from_user, is_class_c, test_group
 from ..functions.group import get_config_text
+from ..functions.regex import get_engine
 from ..functions.telegram import delete_message, get_group_info, send_message, send_report_message
 
 # Enable logging
@@ -69,6 +70,16 @@ def add_command_handlers(dispatcher: Dispatcher) -> bool:
                      & from_user)
         ))
 
+        # /profile
+        dispatcher.add_handler(PrefixHandler(
+            prefix=glovar.prefix,
+            command=["profile"],
+            callback=profile,
+            filters=(Filters.update.messages & Filters.group
+                     & test_group
+                     & from_user)
+        ))
+
         # /version
         dispatcher.add_handler(PrefixHandler(
             prefix=glovar.prefix,
@@ -279,6 +290,57 @@ def long(update: Update, context: CallbackContext) -> bool:
     return False
 
 
+def profile(update: Update, context: CallbackContext) -> bool:
+    # Show the most expensive regex rules
+    result = False
+
+    try:
+        client = context.bot
+        message = update.effective_message
+
+        # Basic data
+        cid = message.chat.id
+        aid = message.from_user.id
+        mid = message.message_id
+
+        # Get the word type
+        word_type = get_command_type(message)
+
+        # Get the profile
+        with glovar.locks["count"]:
+            rows = [(the_type, word, list(one))
+                    for the_type in glovar.regex_profile for word, one in glovar.regex_profile[the_type].items()
+                    if not word_type or the_type == word_type]
+            counts = deepcopy(glovar.regex_counts)
+
+        engines = {(the_type, word): get_engine(pattern)
+                   for the_type in {row[0] for row in rows} for word, pattern, _ in glovar.compiled[the_type].rules}
+
+        rows.sort(key=lambda x: x[2][1], reverse=True)
+
+        # Generate the text
+        text = f"{lang('admin')}{lang('colon')}{mention_id(aid)}\n\n"
+
+        if not rows:
+            text += f"{lang('status')}{lang('colon')}{code(lang('reason_none'))}\n"
+
+        for the_type, word, (calls, total, worst) in rows[:10]:
+            hits = eval(f"glovar.{the_type}_words").get(word, 0) + counts.get(the_type, {}).get(word, 0)
+            text += (f"{lang('regex_type')}{lang('colon')}{code(the_type)}\n"
+                     f"{lang('rule')}{lang('colon')}{code(word[:100])}\n"
+                     f"{lang('regex_engine')}{lang('colon')}{code(engines.get((the_type, word), 're'))}\n"
+                     f"{lang('regex_calls')}{lang('colon')}{code(f'{calls} / {hits}')}\n"
+                     f"{lang('regex_total')}{lang('colon')}{code(f'{total:.3f}s')}\n"
+                     f"{lang('regex_worst')}{lang('colon')}{code(f'{worst:.3f}s')}\n\n")
+
+        # Send the report message
+        result = send_message(client, cid, text, mid)
+    except Exception as e:
+        logger.warning(f"Profile error: {e}", exc_info=True)
+
+    return result
+
+
 def version(update: Update, context: CallbackContext) -> bool:
     # Check the program's version
     result = False
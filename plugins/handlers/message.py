@@ -22,12 +22,13 @@ from telegram import Update
 from telegram.ext import CallbackContext, Dispatcher, Filters, MessageHandler
 
 from .. import glovar
-from ..functions.channel import get_debug_text
-from ..functions.etc import code, general_link, get_full_name, get_now, get_text, lang, thread, mention_id
+from ..functions.channel import get_debug_text, send_quarantine
+from ..functions.etc import MessageContext, code, general_link, get_full_name, get_now, get_text, is_length_reached
+from ..functions.etc import lang, thread, mention_id
 from ..functions.file import save
 from ..functions.filters import authorized_group, captcha_group, class_c, class_d, declared_message, exchange_channel
-from ..functions.filters import from_user, hide_channel, is_class_d_user, is_declared_message, is_long_text, is_nm_text
-from ..functions.filters import new_group, test_group
+from ..functions.filters import from_user, hide_channel, is_class_d_user, is_declared_message, is_long_text
+from ..functions.filters import get_regex_budget, is_name_text, new_group, test_group
 from ..functions.group import leave_group
 from ..functions.ids import init_group_id, init_user_id
 from ..functions.receive import receive_add_bad, receive_add_except, receive_clear_data, receive_config_commit
@@ -126,11 +127,8 @@ def captcha(update: Update, context: CallbackContext) -> bool:
         if not text.strip():
             return True
 
-        # Get length
-        length = len(text.encode())
-
         # Check length
-        if length < 10000:
+        if not is_length_reached(text, 10000):
             return True
 
         # Delete the message
@@ -146,6 +144,9 @@ def captcha(update: Update, context: CallbackContext) -> bool:
 def check(update: Update, context: CallbackContext) -> bool:
     # Check the messages sent from groups
     glovar.locks["message"].acquire()
+    glovar.memo.budget = get_regex_budget()
+    glovar.memo.texts = {}
+    glovar.memo.context = MessageContext(update.effective_message)
     try:
         client = context.bot
         message = update.effective_message
@@ -164,7 +165,11 @@ def check(update: Update, context: CallbackContext) -> bool:
     except Exception as e:
         logger.warning(f"Check error: {e}", exc_info=True)
     finally:
+        glovar.memo.budget = None
+        glovar.memo.texts = None
+        glovar.memo.context = None
         glovar.locks["message"].release()
+        send_quarantine(context.bot)
 
     return False
 
@@ -172,6 +177,8 @@ def check(update: Update, context: CallbackContext) -> bool:
 def check_join(update: Update, context: CallbackContext) -> bool:
     # Check new joined user
     glovar.locks["message"].acquire()
+    glovar.memo.budget = get_regex_budget()
+    glovar.memo.texts = {}
     try:
         _ = context.bot
         message = update.effective_message
@@ -191,9 +198,9 @@ def check_join(update: Update, context: CallbackContext) -> bool:
             # Work with NOSPAM
             if glovar.nospam_id in glovar.admin_ids[gid]:
                 # Check name
-                name = get_full_name(new, True, True)
+                name = get_full_name(new)
 
-                if name and is_nm_text(name):
+                if is_name_text("nm", uid, name, lambda: get_full_name(new, True, True)):
                     return True
 
             # Check declare status
@@ -212,7 +219,10 @@ def check_join(update: Update, context: CallbackContext) -> bool:
     except Exception as e:
         logger.warning(f"Check join error: {e}", exc_info=True)
     finally:
+        glovar.memo.budget = None
+        glovar.memo.texts = None
         glovar.locks["message"].release()
+        send_quarantine(context.bot)
 
     return False
 
@@ -0,0 +1,160 @@
+# SCP-079-LONG - Control super long messages
+# Copyright (C) 2019-2020 SCP-079 <https://scp-079.org>
+#
+# This file is part of SCP-079-LONG.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Benchmark the regex filters, run in the directory of the bot, with its config.ini and data
+# Usage: python -m tools.benchmark [--rules 500] [--json result.json] [--compare old.json]
+
+import json
+from argparse import ArgumentParser, Namespace
+from random import Random
+from statistics import median
+from subprocess import DEVNULL, check_output
+from time import perf_counter
+from typing import Any, Callable, Dict, List
+
+from plugins import glovar
+from plugins.functions.filters import is_ban_text, is_nm_text, is_regex_text, is_wb_text, update_rule_sets
+from .corpus import get_rule_literals, get_rules, get_texts
+
+# Sizes of the messages in UTF-8 bytes
+sizes: List[int] = [500, 1000, 2000, 5000, 10000]
+
+
+def get_args() -> Namespace:
+    # Get the arguments
+    parser = ArgumentParser(description="Benchmark the regex filters")
+    parser.add_argument("--rules", type=int, default=0, help="use this many synthetic rules of each word type")
+    parser.add_argument("--types", default="ad,ban,con,wb", help="word types of is_regex_text, separated by commas")
+    parser.add_argument("--count", type=int, default=50, help="number of messages of each size")
+    parser.add_argument("--repeat", type=int, default=5, help="rounds of each measurement, the median is taken")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the messages and the synthetic rules")
+    parser.add_argument("--json", help="save the results to the file")
+    parser.add_argument("--compare", help="compare the results with a saved file")
+
+    return parser.parse_args()
+
+
+def get_checks(word_types: List[str]) -> Dict[str, Callable[[str], Any]]:
+    # Get the checks to measure
+    result = {f"is_regex_text({word_type})": (lambda text, t=word_type: is_regex_text(t, text))
+              for word_type in word_types}
+    result["is_wb_text"] = lambda text: is_wb_text(text, False)
+    result["is_ban_text"] = lambda text: is_ban_text(text, False)
+    result["is_nm_text"] = lambda text: is_nm_text(text)
+
+    return result
+
+
+def get_commit() -> str:
+    # Get the current commit if available
+    try:
+        return check_output(["git", "describe", "--always", "--dirty"], stderr=DEVNULL).decode().strip()
+    except Exception:
+        return ""
+
+
+def measure(check: Callable[[str], Any], texts: List[str], repeat: int) -> float:
+    # Measure the check, return the median milliseconds of a message
+    costs = []
+
+    for _ in range(repeat):
+        start = perf_counter()
+
+        for text in texts:
+            check(text)
+
+        costs.append((perf_counter() - start) * 1000 / len(texts))
+
+    return median(costs)
+
+
+def set_rules(count: int, seed: int) -> bool:
+    # Replace the rules of every word type with synthetic ones
+    rand = Random(seed)
+
+    with glovar.locks["regex"]:
+        for word_type in glovar.regex:
+            words = {word: 0 for word in get_rules(rand, count)}
+            exec(f"glovar.{word_type}_words = words")
+
+    return update_rule_sets(glovar.regex)
+
+
+def main() -> int:
+    # Run the benchmark
+    args = get_args()
+
+    # The rules should not change while measuring, and no check should skip the rest rules for the budget
+    glovar.regex_budget = 0.0
+    glovar.regex_slow = 0.0
+
+    if args.rules:
+        set_rules(args.rules, args.seed)
+
+    words = {word_type: glovar.compiled[word_type].words for word_type in glovar.regex}
+    literals = get_rule_literals(words)
+    checks = get_checks([word_type for word_type in args.types.split(",") if word_type in glovar.regex])
+    results: Dict[str, Any] = {
+        "commit": get_commit(),
+        "rules": sum(len(one) for one in words.values()),
+        "settings": {
+            "combine": glovar.regex_combine,
+            "prefilter": glovar.regex_prefilter,
+            "engine": glovar.regex_engine,
+            "casefold": glovar.regex_casefold
+        },
+        "results": {}
+    }
+    old = {}
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            old = json.load(f)["results"]
+
+    print(f"Commit: {results['commit'] or 'unknown'}, rules: {results['rules']}, settings: {results['settings']}")
+    print(f"{'check':<24}" + "".join(f"{f'{size}B':>14}" for size in sizes) + "  (ms per message)")
+
+    for name, check in checks.items():
+        line = f"{name:<24}"
+        results["results"][name] = {}
+
+        for size in sizes:
+            texts = get_texts(args.count, size, size, args.seed + size, literals)
+            cost = measure(check, texts, args.repeat)
+            results["results"][name][str(size)] = cost
+            cell = f"{cost:.3f}"
+
+            if old.get(name, {}).get(str(size)):
+                cell += f"/{cost / old[name][str(size)]:.2f}"
+
+            line += f"{cell:>14}"
+
+        print(line)
+
+    if old:
+        print("Values with a slash are followed by the ratio to the compared results, lower is faster")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=4, sort_keys=True)
+
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
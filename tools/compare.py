@@ -0,0 +1,210 @@
+# SCP-079-LONG - Control super long messages
+# Copyright (C) 2019-2020 SCP-079 <https://scp-079.org>
+#
+# This file is part of SCP-079-LONG.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Compare the verdicts of a candidate engine with the plain re checks, offline
+# Usage: python -m tools.compare [--data data] [--corpus file] [--engine re2] [--casefold] ...
+
+import re
+from argparse import ArgumentParser, Namespace
+from time import perf_counter
+from typing import Dict, List, Set, Tuple
+
+from plugins.functions.regex import PreparedText, RuleBundle, RuleSet, engines, flags, get_ban_verdict
+from plugins.functions.regex import get_nm_verdict, get_wb_verdict
+from .corpus import get_rule_literals, get_texts, load_corpus, load_words
+
+
+def get_args() -> Namespace:
+    # Get the arguments
+    parser = ArgumentParser(description="Compare a candidate regex engine with the plain re checks")
+    parser.add_argument("--data", default="data", help="directory of the pickled *_words files")
+    parser.add_argument("--corpus", help="recorded messages, one JSON string or raw text in each line")
+    parser.add_argument("--count", type=int, default=300, help="number of generated messages")
+    parser.add_argument("--low", type=int, default=500, help="minimum size of generated messages in bytes")
+    parser.add_argument("--high", type=int, default=10000, help="maximum size of generated messages in bytes")
+    parser.add_argument("--seed", type=int, default=0, help="seed of generated messages")
+    parser.add_argument("--types", help="word types to compare, separated by commas")
+    parser.add_argument("--ocr", action="store_true", help="check the texts as OCR results")
+    parser.add_argument("--combine", action="store_true", help="candidate: combine the rules")
+    parser.add_argument("--no-prefilter", dest="prefilter", action="store_false", help="candidate: no prefilter")
+    parser.add_argument("--engine", default="re", choices=sorted(engines), help="candidate: regex engine")
+    parser.add_argument("--casefold", action="store_true", help="candidate: casefold pre-pass")
+    parser.add_argument("--show", type=int, default=20, help="number of disagreements to show")
+
+    return parser.parse_args()
+
+
+def get_verdicts(hits: Set[str]) -> Dict[str, bool]:
+    # Get the verdicts of the filters from the hit word types with their own checks, the emoji checks are not included
+    return {
+        "is_wb_text": get_wb_verdict(hits)[0],
+        "is_ban_text": get_ban_verdict(hits, lambda: False)[0],
+        "is_nm_text": get_nm_verdict(hits, lambda: False)[0]
+    }
+
+
+def search_bundle(bundle: RuleBundle, text: PreparedText, ocr: bool) -> Set[str]:
+    # Check the text with all the word types as get_regex_hits does, return the hit word types
+    collapsed = text.get_collapsed()
+    hits = bundle.search(collapsed, ocr, folded=text.get_folded(collapsed))
+    rest = [word_type for word_type in bundle.rule_sets if word_type not in hits]
+
+    # Try again
+    if rest and " " in collapsed:
+        stripped = text.get_stripped()
+        hits.update(bundle.search(stripped, ocr, rest, text.get_folded(stripped)))
+
+    return set(hits)
+
+
+def search_candidate(rule_set: RuleSet, text: PreparedText, ocr: bool) -> str:
+    # Check the text as get_regex_hits does, return the hit rule
+    collapsed = text.get_collapsed()
+    word, result = rule_set.search(collapsed, ocr)
+
+    # Try again
+    if not result and " " in collapsed:
+        word, result = rule_set.search(text.get_stripped(), ocr)
+
+    return word if result else ""
+
+
+def search_reference(words: List[str], text: str, ocr: bool) -> str:
+    # Check the text as is_regex_text did with plain re searches, return the hit rule
+    if not text:
+        return ""
+
+    variants = [re.sub(r"\s{2,}", " ", text)]
+
+    # Try again
+    if " " in variants[0]:
+        variants.append(re.sub(r"\s", "", variants[0]))
+
+    for variant in variants:
+        for word in words:
+            if ocr and "(?# nocr)" in word:
+                continue
+
+            if re.search(word, variant, flags):
+                return word
+
+    return ""
+
+
+def main() -> int:
+    # Run the comparison, return 1 if any verdict differs
+    args = get_args()
+    words = load_words(args.data)
+
+    if args.types:
+        words = {word_type: words[word_type] for word_type in args.types.split(",") if word_type in words}
+
+    if args.corpus:
+        texts = load_corpus(args.corpus)
+    else:
+        texts = get_texts(args.count, args.low, args.high, args.seed, get_rule_literals(words))
+
+    print(f"Messages: {len(texts)}, word types: {len(words)}, rules: {sum(len(w) for w in words.values())}")
+
+    # Hit rules of each text, as [{word type: word}]
+    reference: List[Dict[str, str]] = [{} for _ in texts]
+    candidate: List[Dict[str, str]] = [{} for _ in texts]
+    prepared = [PreparedText(text) for text in texts]
+
+    # Costs of each word type, as {word type: (reference seconds, candidate seconds)}
+    costs: Dict[str, Tuple[float, float]] = {}
+
+    # Disagreements, as [(name, index of the text, reference, candidate)]
+    differences: List[Tuple[str, int, str, str]] = []
+
+    # Rule sets of the candidate
+    rule_sets: Dict[str, RuleSet] = {}
+
+    for word_type, rules in words.items():
+        rule_set = RuleSet(rules, args.combine, args.prefilter, word_type, args.engine, args.casefold)
+        rule_sets[word_type] = rule_set
+
+        start = perf_counter()
+
+        for i, text in enumerate(texts):
+            reference[i][word_type] = search_reference(rules, text, args.ocr)
+
+        middle = perf_counter()
+
+        for i, text in enumerate(prepared):
+            candidate[i][word_type] = search_candidate(rule_set, text, args.ocr)
+
+        costs[word_type] = (middle - start, perf_counter() - middle)
+
+        for i in range(len(texts)):
+            one, other = reference[i][word_type], candidate[i][word_type]
+
+            if bool(one) != bool(other):
+                differences.append((word_type, i, one, other))
+
+    # All the word types checked together, as the filters do
+    bundle = RuleBundle(rule_sets, args.combine, args.prefilter, args.engine, args.casefold)
+    prepared = [PreparedText(text) for text in texts]
+    start = perf_counter()
+    bundle_hits = [search_bundle(bundle, text, args.ocr) for text in prepared]
+    bundle_cost = perf_counter() - start
+
+    for i in range(len(texts)):
+        for word_type in words:
+            hit = word_type in bundle_hits[i]
+
+            if bool(reference[i][word_type]) != hit:
+                differences.append((f"{word_type} (bundle)", i, reference[i][word_type], str(hit)))
+
+    # Rules with a different rank may be credited for the same verdict
+    credits = sum(1 for i in range(len(texts)) for word_type in words
+                  if reference[i][word_type] and candidate[i][word_type]
+                  and reference[i][word_type] != candidate[i][word_type])
+
+    for i in range(len(texts)):
+        one = get_verdicts({word_type for word_type, word in reference[i].items() if word})
+        other = get_verdicts({word_type for word_type, word in candidate[i].items() if word})
+
+        for name in one:
+            if one[name] != other[name]:
+                differences.append((name, i, str(one[name]), str(other[name])))
+
+    print(f"{'type':<8}{'rules':>8}{'hits':>8}{'diff':>8}{'re':>12}{'candidate':>12}{'speedup':>10}")
+
+    for word_type, (old, new) in costs.items():
+        hits = sum(1 for one in reference if one[word_type])
+        diff = sum(1 for difference in differences if difference[0] == word_type)
+        speedup = old / new if new else 0.0
+        print(f"{word_type:<8}{len(words[word_type]):>8}{hits:>8}{diff:>8}{old:>11.3f}s{new:>11.3f}s{speedup:>9.1f}x")
+
+    old = sum(cost[0] for cost in costs.values())
+    new = sum(cost[1] for cost in costs.values())
+    speedup = old / new if new else 0.0
+    print(f"{'total':<8}{'':>24}{len(differences):>8}{old:>11.3f}s{new:>11.3f}s{speedup:>9.1f}x")
+    speedup = old / bundle_cost if bundle_cost else 0.0
+    print(f"{'bundle':<8}{'':>32}{old:>11.3f}s{bundle_cost:>11.3f}s{speedup:>9.1f}x")
+    print(f"Same verdicts credited to other rules: {credits}")
+
+    for name, i, one, other in differences[:args.show]:
+        print(f"\n[{name}] message {i}: re {one!r}, candidate {other!r}\n{texts[i][:200]!r}")
+
+    return 1 if differences else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,154 @@
+# SCP-079-LONG - Control super long messages
+# Copyright (C) 2019-2020 SCP-079 <https://scp-079.org>
+#
+# This file is part of SCP-079-LONG.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import pickle
+from os import listdir
+from os.path import exists, join
+from random import Random
+from typing import Dict, List
+
+from plugins.functions.regex import get_literals, sort_words
+
+# Pieces of the generated texts
+pieces: Dict[str, str] = {
+    "cjk": "广告加群微信返利出售代理兼职日结联系客服免费领取優惠彩票博彩飛機頻道搜索點擊進入",
+    "latin": "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZéüßİı0123456789",
+    "emoji": "😀😂🔥💰🎁✅👉📱🧧💯",
+    "space": "  \n\n\t　 "
+}
+
+# Fragments that often appear in the messages to check
+fragments: List[str] = ["t.me/", "telegram", "wechat", "VX", "QQ", "http://", "https://", "@", ".com", "TG", "USDT"]
+
+
+def get_rule_literals(words: Dict[str, List[str]], limit: int = 1000) -> List[str]:
+    # Get some required literals of the rules, so the generated messages hit the rules sometimes
+    result = []
+
+    for word_type in sorted(words):
+        for word in words[word_type][:limit]:
+            result.extend(get_literals(word))
+
+    return sorted(set(result))
+
+
+def get_rules(rand: Random, count: int) -> List[str]:
+    # Generate rules in the common shapes: words with gaps, alternations, classes, links and OCR exceptions
+    result = []
+
+    while len(result) < count:
+        words = ["".join(rand.choice(pieces["cjk"]) for _ in range(rand.randint(2, 4))) for _ in range(3)]
+        latin = "".join(rand.choice(pieces["latin"][:26]) for _ in range(rand.randint(3, 8)))
+        kind = rand.random()
+
+        if kind < 0.3:
+            rule = f"{words[0]}\\s*{words[1]}"
+        elif kind < 0.5:
+            rule = "|".join(words)
+        elif kind < 0.65:
+            rule = f"{words[0]}.{{0,10}}(?:{words[1]}|{words[2]})"
+        elif kind < 0.8:
+            rule = f"{latin[:2]}[\\W_]*{latin[2:]}"
+        elif kind < 0.9:
+            rule = f"t\\.me/(?:joinchat/)?{latin}"
+        else:
+            rule = f"(?# nocr){words[0]}[0-9]{{3,}}"
+
+        if rule not in result:
+            result.append(rule)
+
+    return result
+
+
+def get_text(rand: Random, size: int, literals: List[str] = None) -> str:
+    # Generate a message of about the size in UTF-8 bytes, mixing CJK, Latin, emoji, whitespace and the literals
+    result = []
+    length = 0
+
+    while length < size:
+        kind = rand.random()
+
+        if kind < 0.35:
+            piece = "".join(rand.choice(pieces["cjk"]) for _ in range(rand.randint(1, 12)))
+        elif kind < 0.65:
+            piece = "".join(rand.choice(pieces["latin"]) for _ in range(rand.randint(1, 10)))
+        elif kind < 0.75:
+            piece = "".join(rand.choice(pieces["emoji"]) for _ in range(rand.randint(1, 3)))
+        elif kind < 0.92:
+            piece = "".join(rand.choice(pieces["space"]) for _ in range(rand.randint(1, 6)))
+        elif literals and kind < 0.97:
+            piece = rand.choice(literals)
+        else:
+            piece = rand.choice(fragments)
+
+        result.append(piece)
+        length += len(piece.encode())
+
+    return "".join(result).encode()[:size].decode(errors="ignore")
+
+
+def get_texts(count: int, low: int, high: int, seed: int = 0, literals: List[str] = None) -> List[str]:
+    # Generate messages with sizes between low and high in UTF-8 bytes, the same seed gives the same messages
+    rand = Random(seed)
+
+    return [get_text(rand, rand.randint(low, high), literals) for _ in range(count)]
+
+
+def load_corpus(path: str) -> List[str]:
+    # Load a recorded corpus, one message in each line, as a JSON string or the raw text
+    result = []
+
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.rstrip("\n")
+
+            try:
+                text = json.loads(line)
+            except ValueError:
+                text = line
+
+            result.append(text if isinstance(text, str) else line)
+
+    return result
+
+
+def load_words(path: str = "data", sort: bool = True) -> Dict[str, List[str]]:
+    # Load the rules of the word types from the pickled data files, in the order of checking if sort is True
+    result = {}
+    ranks = {}
+
+    if sort and exists(join(path, "regex_ranks")):
+        with open(join(path, "regex_ranks"), "rb") as f:
+            ranks = pickle.load(f)
+
+    for file in sorted(listdir(path)):
+        if file.startswith(".") or not file.endswith("_words"):
+            continue
+
+        with open(join(path, file), "rb") as f:
+            words = pickle.load(f)
+
+        word_type = file[:-len("_words")]
+
+        if sort:
+            result[word_type] = sort_words(words, ranks.get(word_type, {}))
+        else:
+            result[word_type] = list(words)
+
+    return result